@@ -1,7 +1,42 @@
+import collections     # for the worklist engine's queues
+import functools       # for partial
+import heapq           # for choosing exact cover columns
+import itertools       # for imap in single-process batch mode
+import multiprocessing # for batch solving in a process pool
+import random          # for the puzzle generator
+import sys             # for sys.argv and batch output
+import time            # for solver statistics
+try:                   # for fast consistency checks
+    import numpy
+except ImportError:
+    numpy = None
+
 BASE = 9
 BLOCK_HEIGHT = 3
 BLOCK_WIDTH = 3
 
+# solver engine used by solve(), one of the keys of ENGINES
+# "sets" - original engine, rescans the field with Python sets after each step
+# "bitmask" - keeps per-row, per-column and per-block bitmasks of used numbers
+# "worklist" - like "bitmask", but only rechecks cells and units affected by a placement
+# "dlx" - solves the sudoku as an exact cover problem using Algorithm X
+ENGINE = "sets"
+
+# depth-first search for complete solutions when propagation alone gets stuck
+SEARCH = False
+# maximum number of solutions to enumerate in search mode, None for all
+MAX_SOLUTIONS = 1
+
+# deduction rules tried in order by the sets, bitmask and worklist engines
+# and search when propagation gets stuck, keys of RULE_FUNCTIONS, set to [] to disable
+RULES = ["pointing", "box_line", "naked_pairs", "hidden_pairs", "naked_triples", "hidden_triples"]
+
+# don't print every pass and solved cell, only the result and statistics
+QUIET = False
+
+# statistics of the last solve(), a SolveStats object
+stats = None
+
 field = [
 [1, 2, 3, 4, 5, 6, 7, 8, 9],
 [4, 5, 6, 7, 8, 9, 1, 2, 3],
@@ -75,73 +110,169 @@ def precheck():
             if not 0 <= cell <= BASE:
                 raise ValueError("Cell {} in row {} ({}) must be greater than 0 and less than {}".format(x, y, cell, BASE))
 
-        for n in BASE_RANGE:
+    check_grid(field, BASE, BLOCK_WIDTH, BLOCK_HEIGHT)
+
+    print("Checks done, field appears to be a valid sudoku. Proceeding to solve...")
+
+def check_grid(grid, base, block_w, block_h):
+    # Check that no number appears more than once in any row, column or block
+    # of grid, raise ValueError otherwise
+    if numpy is not None:
+        check_grid_numpy(grid, base, block_w, block_h)
+    else:
+        check_grid_lists(grid, base, block_w, block_h)
+
+def check_grid_numpy(grid, base, block_w, block_h):
+    # Like check_grid_lists, but counts all numbers of all rows, columns and
+    # blocks at once using NumPy arrays
+    cells = numpy.array(grid, dtype=numpy.intp).reshape(base, base)
+    blocks_per_row = base // block_w
+    units = (
+        ("row", cells),
+        ("column", cells.T),
+        # rows of this array are the blocks from left to right, top to bottom
+        ("block", cells.reshape(base // block_h, block_h, blocks_per_row, block_w)
+                       .transpose(0, 2, 1, 3).reshape(base, base)),
+    )
+
+    # offset every unit by base+1 so one bincount counts numbers per unit
+    offsets = numpy.arange(base).reshape(base, 1) * (base + 1)
+    for kind, unit_cells in units:
+        counts = numpy.bincount((unit_cells + offsets).ravel(), minlength=base * (base + 1))
+        counts = counts.reshape(base, base + 1)
+        # empty cells may appear any number of times
+        counts[:, 0] = 0
+        duplicates = numpy.argwhere(counts > 1)
+        if len(duplicates):
+            i, n = duplicates[0]
+            if kind == "block":
+                raise ValueError("Number {} appears more than once in block y={}, x={}".format(n, i // blocks_per_row, i % blocks_per_row))
+            else:
+                raise ValueError("Number {} appears more than once in {} {}".format(n, kind, i))
+
+def check_grid_lists(grid, base, block_w, block_h):
+    # Like check_grid, using only Python lists
+    base_range = range(1, base+1)
+
+    for y, row in enumerate(grid):
+        for n in base_range:
             if row.count(n) > 1:
                 raise ValueError("Number {} appears more than once in row {}".format(n, y))
 
-    for x, col in enumerate(zip(*field)):
-        for n in BASE_RANGE:
+    for x, col in enumerate(zip(*grid)):
+        for n in base_range:
             if col.count(n) > 1:
                 raise ValueError("Number {} appears more than once in column {}".format(n, x))
 
-    for y in range(BASE / BLOCK_HEIGHT):
-        rows = field[BLOCK_HEIGHT*y:BLOCK_HEIGHT*(y+1)]
-        for x in range(BASE / BLOCK_WIDTH):
+    for y in range(base // block_h):
+        rows = grid[block_h*y:block_h*(y+1)]
+        for x in range(base // block_w):
             block = []
             for row in rows:
-                block += row[BLOCK_WIDTH*x:BLOCK_WIDTH*(x+1)]
+                block += row[block_w*x:block_w*(x+1)]
 
-            for n in BASE_RANGE:
+            for n in base_range:
                 if block.count(n) > 1:
                     raise ValueError("Number {} appears more than once in block y={}, x={}".format(n, y, x))
 
-    print("Checks done, field appears to be a valid sudoku. Proceeding to solve...")
+class SolveStats(object):
+    # Counters and timings collected by the solver engines
+    def __init__(self):
+        self.passes = {}         # number of passes per step
+        self.times = {}          # wall time in seconds spent per step
+        self.naked_singles = 0   # cells solved because they had one possibility
+        self.hidden_singles = 0  # cells solved because a number fit nowhere else
+        self.max_candidates = 0  # most possibilities seen for a single cell
+        self.guesses = 0         # numbers tried by search
+        self.eliminations = {}   # possibilities removed by each deduction rule
+        self.total_time = 0.0    # wall time in seconds of the whole solve
 
-def solve():
-    global field
+    def add_pass(self, step, seconds):
+        # Count a pass of step that took seconds
+        self.passes[step] = self.passes.get(step, 0) + 1
+        self.add_time(step, seconds)
+
+    def add_time(self, step, seconds):
+        # Add seconds to the time of step without counting a pass
+        self.times[step] = self.times.get(step, 0.0) + seconds
+
+    def report(self):
+        # Return a human-readable summary of the statistics
+        lines = ["Statistics:"]
+        for step in sorted(self.passes):
+            lines.append("Step {}: {} passes, {:.3f} s".format(step, self.passes[step], self.times[step]))
+        lines.append("Cells solved: {} naked singles, {} hidden singles".format(self.naked_singles, self.hidden_singles))
+        lines.append("Most possibilities for a cell: {}".format(self.max_candidates))
+        for rule in sorted(self.eliminations):
+            lines.append("Rule {}: {} possibilities removed".format(rule, self.eliminations[rule]))
+        if self.guesses:
+            lines.append("Guesses: {}".format(self.guesses))
+        lines.append("Total time: {:.3f} s".format(self.total_time))
+        return "\n".join(lines)
+
+def sets_propagate(grid, base, block_w, block_h, verbose=True, stats=None):
+    # Solve single-possibility cells of grid in place by rescanning it with sets.
+    # Unsolved cells are left as sets of their possible numbers, cells that
+    # already are sets (e. g. reduced by RULES) keep only those numbers.
+    # If stats is a SolveStats, passes, timings and solved cells are counted in it.
+    # Returns False if a cell without any possibilities was found, else True.
+    base_range = range(1, base+1)
+    consistent = True
 
     # the following loop is just to be able to use "continue", it terminates after one full loop
     step = 1
+    restarted_by = 1  # step that solved a cell and caused the last restart
     while step >= 0:
+        pass_step = step
+        pass_start = time.time()
+
         # reread variables
-        zipfield = zip(*field)
+        zipfield = zip(*grid)
         blocks = []
-        for y in range(BASE / BLOCK_HEIGHT):
+        for y in range(base // block_h):
             blocks.append([])
-            rows = field[BLOCK_HEIGHT*y:BLOCK_HEIGHT*(y+1)]
-            for x in range(BASE / BLOCK_WIDTH):
+            rows = grid[block_h*y:block_h*(y+1)]
+            for x in range(base // block_w):
                 block = []
                 for row in rows:
-                    block += row[BLOCK_WIDTH*x:BLOCK_WIDTH*(x+1)]
+                    block += row[block_w*x:block_w*(x+1)]
                 blocks[y].append(block)
         if step == 0:
             step = 1
         elif step == 1:
             # Step 1: Basic solving of single-possibility cells
-            print("Step 1...")
-            for y, row in enumerate(field):
+            if verbose:
+                print("Step 1...")
+            for y, row in enumerate(grid):
                 for x, cell in enumerate(row):
                     if isinstance(cell, set) or cell == 0:
                         # cell is a list or nonzero number, i. e. unsolved
                         poss = set()
-                        for n in BASE_RANGE:
-                            if n not in row and n not in zipfield[x] and n not in blocks[y//BLOCK_HEIGHT][x//BLOCK_WIDTH]:
+                        for n in (cell if isinstance(cell, set) else base_range):
+                            if n not in row and n not in zipfield[x] and n not in blocks[y//block_h][x//block_w]:
                                 # n does not yet exist in row, column or block
                                 poss.add(n)
                         
+                        if stats is not None:
+                            stats.max_candidates = max(stats.max_candidates, len(poss))
+
                         if len(poss) == 1:
                             # single possibility, cell is solved
-                            print("Cell {} in row {} must be {}".format(x, y, list(poss)[0]))
-                            field[y][x] = list(poss)[0]
+                            if verbose:
+                                print("Cell {} in row {} must be {}".format(x, y, list(poss)[0]))
+                            grid[y][x] = list(poss)[0]
+                            if stats is not None:
+                                stats.naked_singles += 1
                             step = 0
                         elif len(poss) == 0:
                             # no possibilities, something went wrong
-                            print("No possibilities for cell {} in row {}, this should never happen!".format(x, y))
-                            retry = True
+                            if verbose:
+                                print("No possibilities for cell {} in row {}, this should never happen!".format(x, y))
+                            consistent = False
                             step = -1
                         else:
                             # more than one possibility, store for later
-                            field[y][x] = poss
+                            grid[y][x] = poss
                     
                     if step <= 0:
                         break
@@ -151,8 +282,9 @@ def solve():
                 step = 2
         elif step == 2:
             # Step 2: Analyze mutually exclusive possibilities
-            print("Step 2...")
-            for y, row in enumerate(field):
+            if verbose:
+                print("Step 2...")
+            for y, row in enumerate(grid):
                 for x, cell in enumerate(row):
                     if isinstance(cell, set):
                         poss = set()
@@ -180,7 +312,7 @@ def solve():
 
                         # Step 2.3: Correlate with other possibilities in same block
                         oposs = set()
-                        for ocell in blocks[y//BLOCK_HEIGHT][x//BLOCK_WIDTH]:
+                        for ocell in blocks[y//block_h][x//block_w]:
                             if isinstance(ocell, set) and ocell is not cell:
                                 oposs.update(ocell)
                         
@@ -190,15 +322,19 @@ def solve():
                                 poss.add(n)
                         if len(poss) == 1:
                             # single possibility, cell is solved
-                            print("Cell {} in row {} must be {}".format(x, y, list(poss)[0]))
-                            field[y][x] = list(poss)[0]
+                            if verbose:
+                                print("Cell {} in row {} must be {}".format(x, y, list(poss)[0]))
+                            grid[y][x] = list(poss)[0]
+                            if stats is not None:
+                                stats.hidden_singles += 1
                             step = 0
                         elif len(poss) == 0:
                             # no possibilities, simply ignore
                             pass
                         else:
                             # more than one possibility, something went wrong
-                            print("More than one possibility ({}) in step 2 for cell {} in row {}, this should not happen!".format(poss, x, y))
+                            if verbose:
+                                print("More than one possibility ({}) in step 2 for cell {} in row {}, this should not happen!".format(poss, x, y))
                     
                     if step <= 0:
                         break
@@ -206,12 +342,932 @@ def solve():
                     break
             if step == 2:
                 step = -1
-    
+
+        if pass_step == 0:
+            # restarting is part of the work of the step that caused it,
+            # step 0 is precheck's consistency check in the statistics
+            if stats is not None:
+                stats.add_time(restarted_by, time.time() - pass_start)
+        else:
+            if stats is not None:
+                stats.add_pass(pass_step, time.time() - pass_start)
+            restarted_by = pass_step
+
+    return consistent
+
+def solve_sets():
+    global field, stats
+
+    stats = SolveStats()
+    start = time.time()
+    deduce(field, BASE, BLOCK_WIDTH, BLOCK_HEIGHT, selected_rules(), not QUIET, stats, sets_propagate)
+    stats.total_time = time.time() - start
+    print_field()
+    print(stats.report())
+
+def mask_to_numbers(mask):
+    # Return a list of the numbers whose bits are set in mask (bit 0 is number 1)
+    numbers = []
+    n = 1
+    while mask:
+        if mask & 1:
+            numbers.append(n)
+        mask >>= 1
+        n += 1
+    return numbers
+
+def grid_units(base, block_w, block_h):
+    # Return lists of the cells (y, x) of every row, column and block
+    rows = [[(y, x) for x in range(base)] for y in range(base)]
+    cols = [[(y, x) for y in range(base)] for x in range(base)]
+    blocks = []
+    for by in range(base // block_h):
+        for bx in range(base // block_w):
+            blocks.append([(y, x) for y in range(block_h*by, block_h*(by+1))
+                                  for x in range(block_w*bx, block_w*(bx+1))])
+    return rows, cols, blocks
+
+def bitmask_propagate(grid, base, block_w, block_h, verbose=True, stats=None):
+    # Solve single-possibility cells of grid in place using candidate bitmasks.
+    # Unsolved cells are left as sets of their possible numbers.
+    # If stats is a SolveStats, passes, timings and solved cells are counted in it.
+    # Returns False if a cell without any possibilities was found, else True.
+    full = (1 << base) - 1
+    blocks_per_row = base // block_w
+    used_rows = [0] * base
+    used_cols = [0] * base
+    used_blocks = [0] * base
+    unsolved = set()
+    # possibilities of cells that are already sets, e. g. reduced by RULES
+    allowed = {}
+
+    for y, row in enumerate(grid):
+        for x, cell in enumerate(row):
+            if isinstance(cell, set):
+                unsolved.add((y, x))
+                allowed[(y, x)] = sum(1 << (n - 1) for n in cell)
+            elif cell == 0:
+                unsolved.add((y, x))
+            else:
+                bit = 1 << (cell - 1)
+                used_rows[y] |= bit
+                used_cols[x] |= bit
+                used_blocks[(y // block_h) * blocks_per_row + x // block_w] |= bit
+
+    def place(y, x, n):
+        bit = 1 << (n - 1)
+        grid[y][x] = n
+        used_rows[y] |= bit
+        used_cols[x] |= bit
+        used_blocks[(y // block_h) * blocks_per_row + x // block_w] |= bit
+        unsolved.discard((y, x))
+        if verbose:
+            print("Cell {} in row {} must be {}".format(x, y, n))
+
+    def candidates(y, x):
+        return allowed.get((y, x), full) & ~(used_rows[y] | used_cols[x] | used_blocks[(y // block_h) * blocks_per_row + x // block_w])
+
+    # cells of every row, column and block, for hidden single detection
+    rows, cols, blocks = grid_units(base, block_w, block_h)
+    units = rows + cols + blocks
+
+    progress = True
+    while progress and unsolved:
+        progress = False
+
+        # Step 1: naked singles, cells with only one possible number
+        pass_start = time.time()
+        for y, x in sorted(unsolved):
+            poss = candidates(y, x)
+            if stats is not None:
+                stats.max_candidates = max(stats.max_candidates, bin(poss).count("1"))
+            if poss == 0:
+                if verbose:
+                    print("No possibilities for cell {} in row {}, this should never happen!".format(x, y))
+                if stats is not None:
+                    stats.add_pass(1, time.time() - pass_start)
+                return False
+            elif poss & (poss - 1) == 0:
+                place(y, x, poss.bit_length())
+                if stats is not None:
+                    stats.naked_singles += 1
+                progress = True
+        if stats is not None:
+            stats.add_pass(1, time.time() - pass_start)
+
+        # Step 2: hidden singles, numbers that fit only one cell of a unit
+        pass_start = time.time()
+        for unit in units:
+            once = twice = 0
+            for y, x in unit:
+                if (y, x) in unsolved:
+                    poss = candidates(y, x)
+                    twice |= once & poss
+                    once |= poss
+            hidden = once & ~twice
+            if not hidden:
+                continue
+            for y, x in unit:
+                if (y, x) in unsolved:
+                    poss = candidates(y, x) & hidden
+                    if poss and poss & (poss - 1) == 0:
+                        place(y, x, poss.bit_length())
+                        if stats is not None:
+                            stats.hidden_singles += 1
+                        progress = True
+        if stats is not None:
+            stats.add_pass(2, time.time() - pass_start)
+
+    for y, x in unsolved:
+        grid[y][x] = set(mask_to_numbers(candidates(y, x)))
+
+    return True
+
+# cache for cell_topology, keyed by geometry
+_topologies = {}
+
+def cell_topology(base, block_w, block_h):
+    # Return the cells of every unit, the units of every cell and the peers of
+    # every cell (those sharing a unit with it), with cells numbered
+    # y * base + x. The result is cached for every geometry and must not be changed.
+    key = (base, block_w, block_h)
+    if key not in _topologies:
+        units = [[y * base + x for y, x in unit] for unit in itertools.chain(*grid_units(base, block_w, block_h))]
+        units_of = [[] for i in range(base * base)]
+        for u, unit in enumerate(units):
+            for i in unit:
+                units_of[i].append(u)
+        peers = [tuple(set(j for u in units_of[i] for j in units[u]) - set([i])) for i in range(base * base)]
+        _topologies[key] = (units, units_of, peers)
+    return _topologies[key]
+
+def worklist_propagate(grid, base, block_w, block_h, verbose=True, stats=None):
+    # Like bitmask_propagate, but instead of rescanning the grid until nothing
+    # changes, every placement only queues the cells and units it affects:
+    # peers left with one possibility are checked for naked singles, and the
+    # units of peers that lost a possibility are checked for hidden singles.
+    # Cells are numbered y * base + x internally.
+    full = (1 << base) - 1
+    units, units_of, peers = cell_topology(base, block_w, block_h)
+
+    values = [0] * (base * base)
+    poss = [full] * (base * base)
+    cell_queue = collections.deque()
+    unit_queue = collections.deque(range(len(units)))
+    queued_units = set(unit_queue)
+
+    def remove_from_peers(i, bit):
+        # Remove bit from the possibilities of the unsolved peers of i,
+        # return False if one of them has no possibilities left
+        for j in peers[i]:
+            if not values[j] and poss[j] & bit:
+                poss[j] &= ~bit
+                if poss[j] == 0:
+                    if verbose:
+                        print("No possibilities for cell {} in row {}, this should never happen!".format(j % base, j // base))
+                    return False
+                elif poss[j] & (poss[j] - 1) == 0:
+                    cell_queue.append(j)
+                for u in units_of[j]:
+                    if u not in queued_units:
+                        queued_units.add(u)
+                        unit_queue.append(u)
+        return True
+
+    def place(i, n):
+        values[i] = n
+        poss[i] = 1 << (n - 1)
+        grid[i // base][i % base] = n
+        if verbose:
+            print("Cell {} in row {} must be {}".format(i % base, i // base, n))
+        # the other possibilities of i are gone from its units
+        for u in units_of[i]:
+            if u not in queued_units:
+                queued_units.add(u)
+                unit_queue.append(u)
+        return remove_from_peers(i, poss[i])
+
+    for y, row in enumerate(grid):
+        for x, cell in enumerate(row):
+            if isinstance(cell, set):
+                poss[y * base + x] = sum(1 << (n - 1) for n in cell)
+            elif cell != 0:
+                values[y * base + x] = cell
+                poss[y * base + x] = 1 << (cell - 1)
+
+    for i in range(base * base):
+        if values[i] and not remove_from_peers(i, poss[i]):
+            return False
+
+    for i in range(base * base):
+        if not values[i]:
+            if stats is not None:
+                stats.max_candidates = max(stats.max_candidates, bin(poss[i]).count("1"))
+            if poss[i] == 0:
+                if verbose:
+                    print("No possibilities for cell {} in row {}, this should never happen!".format(i % base, i // base))
+                return False
+            elif poss[i] & (poss[i] - 1) == 0:
+                cell_queue.append(i)
+
+    # time spent on each step, recorded as one pass per step that had work
+    spent = {}
+    try:
+        while cell_queue or unit_queue:
+            start = time.time()
+            if cell_queue:
+                # Step 1: naked single, a peer was left with one possibility
+                step = 1
+                i = cell_queue.popleft()
+                if not values[i]:
+                    if not place(i, poss[i].bit_length()):
+                        return False
+                    if stats is not None:
+                        stats.naked_singles += 1
+            else:
+                # Step 2: hidden singles in a unit where possibilities were removed
+                step = 2
+                u = unit_queue.popleft()
+                queued_units.discard(u)
+                once = twice = placed = 0
+                for i in units[u]:
+                    if values[i]:
+                        placed |= poss[i]
+                    else:
+                        twice |= once & poss[i]
+                        once |= poss[i]
+                if once | placed != full:
+                    # some number cannot go anywhere in this unit
+                    return False
+                hidden = once & ~twice
+                for i in units[u]:
+                    if not values[i] and poss[i] & hidden:
+                        bit = poss[i] & hidden
+                        if bit & (bit - 1):
+                            # two numbers can only go in this cell
+                            return False
+                        if not place(i, bit.bit_length()):
+                            return False
+                        if stats is not None:
+                            stats.hidden_singles += 1
+            spent[step] = spent.get(step, 0.0) + time.time() - start
+    finally:
+        if stats is not None:
+            for step in sorted(spent):
+                stats.add_pass(step, spent[step])
+
+    for i in range(base * base):
+        if not values[i]:
+            grid[i // base][i % base] = set(mask_to_numbers(poss[i]))
+
+    return True
+
+def _eliminate(grid, cells, numbers):
+    # Remove numbers from the possibilities of all unsolved cells, return how many were removed
+    removed = 0
+    for y, x in cells:
+        cell = grid[y][x]
+        if isinstance(cell, set):
+            before = len(cell)
+            cell -= numbers
+            removed += before - len(cell)
+    return removed
+
+def _positions(grid, unit):
+    # Return a dict of the unsolved cells of unit where each number is possible
+    positions = {}
+    for y, x in unit:
+        cell = grid[y][x]
+        if isinstance(cell, set):
+            for n in cell:
+                positions.setdefault(n, []).append((y, x))
+    return positions
+
+def naked_subsets(grid, units, size):
+    # If size cells of a unit together have only size possibilities, these
+    # numbers must go in these cells and can be removed from the others
+    removed = 0
+    for unit in itertools.chain(*units):
+        cells = [(y, x) for y, x in unit if isinstance(grid[y][x], set) and 1 < len(grid[y][x]) <= size]
+        for subset in itertools.combinations(cells, size):
+            numbers = set().union(*(grid[y][x] for y, x in subset))
+            if len(numbers) == size:
+                removed += _eliminate(grid, [cell for cell in unit if cell not in subset], numbers)
+    return removed
+
+def hidden_subsets(grid, units, size):
+    # If size numbers of a unit are possible in only size cells, these cells
+    # must contain these numbers and all other possibilities can be removed
+    removed = 0
+    for unit in itertools.chain(*units):
+        positions = _positions(grid, unit)
+        numbers = [n for n, cells in positions.iteritems() if 1 < len(cells) <= size]
+        for subset in itertools.combinations(numbers, size):
+            cells = set().union(*(positions[n] for n in subset))
+            if len(cells) == size:
+                for y, x in cells:
+                    before = len(grid[y][x])
+                    grid[y][x] &= set(subset)
+                    removed += before - len(grid[y][x])
+    return removed
+
+def naked_pairs(grid, units):
+    return naked_subsets(grid, units, 2)
+
+def naked_triples(grid, units):
+    return naked_subsets(grid, units, 3)
+
+def hidden_pairs(grid, units):
+    return hidden_subsets(grid, units, 2)
+
+def hidden_triples(grid, units):
+    return hidden_subsets(grid, units, 3)
+
+def pointing(grid, units):
+    # If a number is possible only in one row or column of a block, it cannot
+    # go anywhere else in that row or column
+    rows, cols, blocks = units
+    removed = 0
+    for block in blocks:
+        for n, cells in _positions(grid, block).iteritems():
+            ys = set(y for y, x in cells)
+            xs = set(x for y, x in cells)
+            if len(ys) == 1:
+                removed += _eliminate(grid, [cell for cell in rows[ys.pop()] if cell not in block], set([n]))
+            elif len(xs) == 1:
+                removed += _eliminate(grid, [cell for cell in cols[xs.pop()] if cell not in block], set([n]))
+    return removed
+
+def box_line(grid, units):
+    # If a number is possible only in one block of a row or column, it cannot
+    # go anywhere else in that block
+    rows, cols, blocks = units
+    block_of = {}
+    for i, block in enumerate(blocks):
+        for cell in block:
+            block_of[cell] = i
+    removed = 0
+    for line in rows + cols:
+        for n, cells in _positions(grid, line).iteritems():
+            indices = set(block_of[cell] for cell in cells)
+            if len(indices) == 1:
+                removed += _eliminate(grid, [cell for cell in blocks[indices.pop()] if cell not in line], set([n]))
+    return removed
+
+RULE_FUNCTIONS = {
+    "pointing": pointing,
+    "box_line": box_line,
+    "naked_pairs": naked_pairs,
+    "naked_triples": naked_triples,
+    "hidden_pairs": hidden_pairs,
+    "hidden_triples": hidden_triples,
+}
+
+# all deduction rules, cheapest first
+ALL_RULES = (pointing, box_line, naked_pairs, hidden_pairs, naked_triples, hidden_triples)
+
+def selected_rules():
+    # Return the functions of the rules named in RULES
+    try:
+        return [RULE_FUNCTIONS[name] for name in RULES]
+    except KeyError as err:
+        raise ValueError("Unknown rule in RULES ({}), must be one of: {}".format(err.args[0], ", ".join(sorted(RULE_FUNCTIONS))))
+
+def deduce(grid, base, block_w, block_h, rules=ALL_RULES, verbose=True, stats=None, propagate=bitmask_propagate):
+    # Solve grid in place like propagate (sets_propagate, bitmask_propagate
+    # or worklist_propagate), but whenever that gets stuck, remove possibilities
+    # using the first of rules that finds any and retry.
+    # Each rule is called with grid and the cells of all rows, columns and
+    # blocks as returned by grid_units, and returns the number of removed
+    # possibilities.
+    # Returns False if a cell without any possibilities was found, else True.
+    units = grid_units(base, block_w, block_h)
+    while True:
+        if not propagate(grid, base, block_w, block_h, verbose, stats):
+            return False
+
+        for rule in rules:
+            removed = rule(grid, units)
+            if removed:
+                if verbose:
+                    print("Rule {} removed {} possibilities".format(rule.__name__, removed))
+                if stats is not None:
+                    stats.eliminations[rule.__name__] = stats.eliminations.get(rule.__name__, 0) + removed
+                break
+        else:
+            # no rule could remove anything, or all cells are solved
+            return True
+
+def solve_bitmask():
+    global field, stats
+
+    print("Solving with bitmask engine...")
+    stats = SolveStats()
+    start = time.time()
+    deduce(field, BASE, BLOCK_WIDTH, BLOCK_HEIGHT, selected_rules(), not QUIET, stats)
+    stats.total_time = time.time() - start
+    print_field()
+    print(stats.report())
+
+def solve_worklist():
+    global field, stats
+
+    print("Solving with worklist engine...")
+    stats = SolveStats()
+    start = time.time()
+    deduce(field, BASE, BLOCK_WIDTH, BLOCK_HEIGHT, selected_rules(), not QUIET, stats, worklist_propagate)
+    stats.total_time = time.time() - start
+    print_field()
+    print(stats.report())
+
+def search_solutions(grid, base, block_w, block_h, limit=None, stats=None, rules=ALL_RULES, propagate=bitmask_propagate):
+    # Find complete solutions of grid by depth-first search, propagating
+    # single possibilities and applying rules (see deduce) before each guess,
+    # always branching on the unsolved cell with the fewest possibilities.
+    # If stats is a SolveStats, propagation and guesses are counted in it.
+    # Returns a list of at most limit solved grids, grid itself is not changed.
+    solutions = []
+    stack = [[[set(cell) if isinstance(cell, set) else cell for cell in row] for row in grid]]
+    while stack:
+        branch = stack.pop()
+        if not deduce(branch, base, block_w, block_h, rules, False, stats, propagate):
+            # dead end, try the next guess
+            continue
+
+        best = None
+        for y, row in enumerate(branch):
+            for x, cell in enumerate(row):
+                if isinstance(cell, set) and (best is None or len(cell) < len(branch[best[0]][best[1]])):
+                    best = (y, x)
+
+        if best is None:
+            # no unsolved cells left
+            solutions.append(branch)
+            if limit is not None and len(solutions) >= limit:
+                break
+            continue
+
+        y, x = best
+        # push in reverse so that smaller numbers are tried first
+        for n in sorted(branch[y][x], reverse=True):
+            guess = [[set(cell) if isinstance(cell, set) else cell for cell in row] for row in branch]
+            guess[y][x] = n
+            stack.append(guess)
+        if stats is not None:
+            stats.guesses += len(branch[y][x])
+
+    return solutions
+
+class ExactCover(object):
+    # Exact cover matrix of a sudoku for Knuth's Algorithm X, stored as dicts
+    # of sets rather than doubly linked lists. Each matrix row (y, x, n)
+    # places n at x, y and covers four constraints: cell y, x is filled and
+    # row y, column x and the block each contain n. Constraints are tuples
+    # starting with CELL, BLOCK, COL or ROW, so that cell constraints sort
+    # first. solutions leaves the matrix as it was, so it can be built once
+    # and used for many grids of the same size.
+    CELL, BLOCK, COL, ROW = range(4)
+
+    def __init__(self, base, block_w, block_h):
+        # init, builds the matrix for an empty grid
+        self.base = base
+        blocks_per_row = base // block_w
+        self.rows = {}
+        self.cols = {}
+        for y in range(base):
+            for x in range(base):
+                b = (y // block_h) * blocks_per_row + x // block_w
+                for n in range(1, base+1):
+                    constraints = ((self.CELL, y, x), (self.ROW, y, n), (self.COL, x, n), (self.BLOCK, b, n))
+                    self.rows[(y, x, n)] = constraints
+                    for c in constraints:
+                        self.cols.setdefault(c, set()).add((y, x, n))
+
+        # heap of (number of rows, column) entries. Every column has an entry
+        # with at most its number of rows: entries are pushed when a column
+        # shrinks or is restored, but not when it grows. Outdated entries are
+        # skipped or pushed again with the right size when choosing a column.
+        self.heap = [(len(rs), c) for c, rs in self.cols.iteritems()]
+        heapq.heapify(self.heap)
+
+    def select(self, r):
+        # Remove all columns covered by r and all rows that conflict with it,
+        # return the removed columns for deselect
+        rows, cols, heap = self.rows, self.cols, self.heap
+        removed = []
+        for c in rows[r]:
+            for i in cols[c]:
+                for k in rows[i]:
+                    if k != c:
+                        ks = cols[k]
+                        ks.remove(i)
+                        heapq.heappush(heap, (len(ks), k))
+            removed.append(cols.pop(c))
+        return removed
+
+    def deselect(self, r, removed):
+        # Undo select(r), selections must be undone in reverse order
+        rows, cols, heap = self.rows, self.cols, self.heap
+        for c in reversed(rows[r]):
+            cols[c] = removed.pop()
+            for i in cols[c]:
+                for k in rows[i]:
+                    if k != c:
+                        cols[k].add(i)
+            heapq.heappush(heap, (len(cols[c]), c))
+
+    def hide(self, r):
+        # Remove only the row r, its number can't go in its cell
+        for c in self.rows[r]:
+            cs = self.cols[c]
+            cs.remove(r)
+            heapq.heappush(self.heap, (len(cs), c))
+
+    def unhide(self, r):
+        # Undo hide(r)
+        for c in self.rows[r]:
+            self.cols[c].add(r)
+
+    def choose(self):
+        # Return the column with the fewest rows left, preferring cell
+        # constraints in row order to avoid thrashing on sparse grids
+        cols, heap = self.cols, self.heap
+        if len(heap) > 4 * len(cols) + 1024:
+            # drop outdated entries
+            heap[:] = [(len(rs), c) for c, rs in cols.iteritems()]
+            heapq.heapify(heap)
+        while True:
+            size, c = heap[0]
+            if c in cols:
+                if len(cols[c]) == size:
+                    return c
+                # the column grew since the entry was pushed
+                heapq.heapreplace(heap, (len(cols[c]), c))
+            else:
+                heapq.heappop(heap)
+
+    def solutions(self, grid, limit=None, stats=None):
+        # Find complete solutions of grid. Cells that are sets may only take
+        # the numbers in them. If stats is a SolveStats, the matrix rows tried
+        # are counted in it as guesses.
+        # Returns a list of at most limit solved grids, grid itself is not changed.
+        base = self.base
+        hidden = [(y, x, n) for y, row in enumerate(grid) for x, cell in enumerate(row)
+                  if isinstance(cell, set) for n in range(1, base+1) if n not in cell]
+        for r in hidden:
+            self.hide(r)
+        # each entry holds a selected row and its removed columns
+        givens = []
+        solutions = []
+        try:
+            for y, row in enumerate(grid):
+                for x, cell in enumerate(row):
+                    if not isinstance(cell, set) and cell != 0:
+                        r = (y, x, cell)
+                        if not all(c in self.cols for c in self.rows[r]):
+                            # given numbers conflict with each other
+                            return solutions
+                        givens.append((r, self.select(r)))
+            self._search(givens, solutions, limit, stats)
+            return solutions
+        finally:
+            for r, removed in reversed(givens):
+                self.deselect(r, removed)
+            for r in reversed(hidden):
+                self.unhide(r)
+
+    def _search(self, givens, solutions, limit, stats):
+        # Add solutions to the list solutions until there are limit of them
+        # or all were found, the matrix is restored afterwards
+        # each frame holds the untried rows, the selected row and its removed columns
+        stack = []
+        try:
+            while True:
+                if not self.cols:
+                    solution = [[0] * self.base for y in range(self.base)]
+                    for y, x, n in [r for r, removed in givens] + [frame[1] for frame in stack]:
+                        solution[y][x] = n
+                    solutions.append(solution)
+                    if limit is not None and len(solutions) >= limit:
+                        break
+                else:
+                    c = self.choose()
+                    stack.append([sorted(self.cols[c], reverse=True), None, None])
+
+                # advance to the next untried row, backtracking as needed
+                while stack:
+                    frame = stack[-1]
+                    if frame[1] is not None:
+                        self.deselect(frame[1], frame[2])
+                        frame[1] = frame[2] = None
+                    if frame[0]:
+                        frame[1] = frame[0].pop()
+                        frame[2] = self.select(frame[1])
+                        if stats is not None:
+                            stats.guesses += 1
+                        break
+                    stack.pop()
+                else:
+                    break
+        finally:
+            for frame in reversed(stack):
+                if frame[1] is not None:
+                    self.deselect(frame[1], frame[2])
+
+def dlx_solutions(grid, base, block_w, block_h, limit=None, stats=None, matrix=None):
+    # Find complete solutions of grid using Knuth's Algorithm X, see
+    # ExactCover. matrix is an ExactCover of the same size to reuse, a new
+    # one is built if it is None.
+    # If stats is a SolveStats, the matrix rows tried are counted in it as guesses.
+    # Returns a list of at most limit solved grids, grid itself is not changed.
+    if matrix is None:
+        matrix = ExactCover(base, block_w, block_h)
+    return matrix.solutions(grid, limit, stats)
+
+def solve_dlx():
+    global field, stats
+
+    print("Solving with exact cover engine...")
+    stats = SolveStats()
+    start = time.time()
+    solutions = dlx_solutions(field, BASE, BLOCK_WIDTH, BLOCK_HEIGHT, 1, stats)
+    stats.total_time = time.time() - start
+    if solutions:
+        field = solutions[0]
+    else:
+        print("No solutions found, the sudoku is unsolvable!")
+    print_field()
+    print(stats.report())
+
+def solve_search():
+    global field, stats
+
+    print("Searching for solutions...")
+    stats = SolveStats()
+    start = time.time()
+    if ENGINE == "dlx":
+        solutions = dlx_solutions(field, BASE, BLOCK_WIDTH, BLOCK_HEIGHT, MAX_SOLUTIONS, stats)
+    else:
+        propagate = worklist_propagate if ENGINE == "worklist" else bitmask_propagate
+        solutions = search_solutions(field, BASE, BLOCK_WIDTH, BLOCK_HEIGHT, MAX_SOLUTIONS, stats, selected_rules(), propagate)
+    stats.total_time = time.time() - start
+    if not solutions:
+        print("No solutions found, the sudoku is unsolvable!")
+        print(stats.report())
+        return solutions
+
+    for i, solution in enumerate(solutions):
+        print("Solution {}:".format(i + 1))
+        print_field(solution)
+    print(stats.report())
+    field = solutions[0]
+    return solutions
+
+ENGINES = {
+    "sets": solve_sets,
+    "bitmask": solve_bitmask,
+    "worklist": solve_worklist,
+    "dlx": solve_dlx,
+}
+
+def solve():
+    # Solve field using the engine selected by ENGINE, or by search if SEARCH is set.
+    # In search mode the list of found solutions is returned.
+    if SEARCH:
+        return solve_search()
+
+    try:
+        engine = ENGINES[ENGINE]
+    except KeyError:
+        raise ValueError("Unknown ENGINE ({}), must be one of: {}".format(ENGINE, ", ".join(sorted(ENGINES))))
+    engine()
+
+PROPAGATORS = {
+    "sets": functools.partial(deduce, propagate=sets_propagate),
+    "bitmask": deduce,
+    "worklist": functools.partial(deduce, propagate=worklist_propagate),
+}
+
+def solve_grid(grid, base, block_w, block_h, engine="dlx", search=False):
+    # Solve a sudoku without using the module-level settings or field, so that
+    # it can be called from several threads or processes at once.
+    # grid is a list of rows of ints with 0 for empty cells, it is not changed.
+    # Returns the solved grid, where cells the engine could not solve are sets
+    # of their possible numbers, or None if the sudoku is unsolvable.
+    try:
+        check_grid(grid, base, block_w, block_h)
+    except ValueError:
+        # given numbers conflict with each other
+        return None
+
+    if engine == "dlx":
+        solutions = dlx_solutions(grid, base, block_w, block_h, 1)
+        return solutions[0] if solutions else None
+    elif engine not in PROPAGATORS:
+        raise ValueError("Unknown engine ({}), must be one of: {}".format(engine, ", ".join(sorted(ENGINES))))
+    elif search:
+        propagate = {"sets": sets_propagate, "worklist": worklist_propagate}.get(engine, bitmask_propagate)
+        solutions = search_solutions(grid, base, block_w, block_h, 1, propagate=propagate)
+        return solutions[0] if solutions else None
+
+    grid = [[set(cell) if isinstance(cell, set) else cell for cell in row] for row in grid]
+    if not PROPAGATORS[engine](grid, base, block_w, block_h, verbose=False):
+        return None
+    return grid
+
+def print_field(grid=None):
+    if grid is None:
+        grid = field
     print("Final result: [")
-    for row in field:
+    for row in grid:
         print(str(row) + ",")
     print("]")
 
+# digits of puzzle strings, "0" or "." mark an empty cell
+DIGITS = "123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+def block_size(base):
+    # Return the most square block width and height for base, with blocks
+    # at least as wide as they are high
+    block_h = int(base ** 0.5)
+    while base % block_h != 0:
+        block_h -= 1
+    return base // block_h, block_h
+
+def parse_puzzle(line, block_w=None, block_h=None):
+    # Parse a puzzle string with one digit per cell, row by row, like the
+    # common 81-character format. The base is taken from the string length.
+    # Returns grid, base, block width and block height.
+    line = line.strip()
+    base = int(round(len(line) ** 0.5))
+    if base * base != len(line):
+        raise ValueError("Puzzle length ({}) is not a square number".format(len(line)))
+
+    if base > len(DIGITS):
+        raise ValueError("Number base ({}) is too large for puzzle strings, maximum is {}".format(base, len(DIGITS)))
+
+    if block_w is None or block_h is None:
+        block_w, block_h = block_size(base)
+
+    if block_w * block_h != base:
+        raise ValueError("Block size ({} by {}) does not match number base ({})".format(block_w, block_h, base))
+
+    grid = []
+    for y in range(base):
+        row = []
+        for x, char in enumerate(line[base*y:base*(y+1)]):
+            if char in "0.":
+                row.append(0)
+            else:
+                n = DIGITS.find(char) + 1
+                if not 0 < n <= base:
+                    raise ValueError("Cell {} in row {} ({}) is not a digit of base {}".format(x, y, char, base))
+                row.append(n)
+        grid.append(row)
+
+    return grid, base, block_w, block_h
+
+def format_puzzle(grid):
+    # Format grid as a puzzle string, unsolved cells become "."
+    return "".join("." if isinstance(cell, set) or cell == 0 else DIGITS[cell-1]
+                   for row in grid for cell in row)
+
+def _solve_line(args):
+    # Solve a single puzzle string for solve_batch, module-level to be picklable
+    line, block_w, block_h, engine, search = args
+    try:
+        grid, base, block_w, block_h = parse_puzzle(line, block_w, block_h)
+        check_grid(grid, base, block_w, block_h)
+        solution = solve_grid(grid, base, block_w, block_h, engine, search)
+    except ValueError as err:
+        return line, None, str(err)
+
+    if solution is None:
+        return line, None, "No solutions found, the sudoku is unsolvable"
+    return line, format_puzzle(solution), None
+
+def solve_batch(lines, block_w=None, block_h=None, engine="dlx", search=False, processes=None, chunksize=16):
+    # Solve many puzzle strings in a pool of processes, ignoring empty lines
+    # and comments starting with "#". Yields (puzzle, solution, error) for
+    # every puzzle in input order, solution is None if the puzzle failed.
+    # processes is the pool size (default one per CPU), 1 disables the pool.
+    puzzles = (line.split("#", 1)[0].strip() for line in lines)
+    tasks = ((puzzle, block_w, block_h, engine, search) for puzzle in puzzles if puzzle)
+
+    if processes == 1:
+        for result in itertools.imap(_solve_line, tasks):
+            yield result
+        return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap(_solve_line, tasks, chunksize):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def solve_file(path, out_path=None, **kwargs):
+    # Solve all puzzles in the file at path, one per line, and write the
+    # solutions to out_path or stdout. Failed puzzles are written unchanged,
+    # followed by " # " and the error message.
+    # Keyword arguments are passed to solve_batch.
+    # Returns the number of solved and failed puzzles.
+    solved = failed = 0
+    out = open(out_path, "w") if out_path else sys.stdout
+    try:
+        with open(path) as f:
+            for puzzle, solution, error in solve_batch(f, **kwargs):
+                if error is None:
+                    out.write(solution + "\n")
+                    solved += 1
+                else:
+                    out.write(puzzle + " # " + error + "\n")
+                    failed += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    return solved, failed
+
+def count_solutions(grid, base, block_w, block_h, limit=2, matrix=None):
+    # Count the solutions of grid, stopping at limit. Exact cover search finds
+    # the first two solutions faster than running the deduction rules first.
+    # matrix is an ExactCover to reuse, as for dlx_solutions.
+    return len(dlx_solutions(grid, base, block_w, block_h, limit, matrix=matrix))
+
+def random_grid(base, block_w, block_h, rng=random):
+    # Return a random completely filled grid. A solved empty grid is shuffled by
+    # relabeling numbers, swapping rows inside a band of blocks, columns inside
+    # a stack of blocks, and whole bands and stacks, which all keep it valid.
+    grid = dlx_solutions([[0] * base for y in range(base)], base, block_w, block_h, 1)[0]
+
+    labels = range(1, base+1)
+    rng.shuffle(labels)
+
+    bands = [range(block_h*i, block_h*(i+1)) for i in range(base // block_h)]
+    rng.shuffle(bands)
+    for band in bands:
+        rng.shuffle(band)
+
+    stacks = [range(block_w*i, block_w*(i+1)) for i in range(base // block_w)]
+    rng.shuffle(stacks)
+    for stack in stacks:
+        rng.shuffle(stack)
+
+    return [[labels[grid[y][x] - 1] for stack in stacks for x in stack]
+            for band in bands for y in band]
+
+def generate_puzzle(base, block_w, block_h, rng=random):
+    # Generate a random puzzle with a unique solution by removing numbers from
+    # a random full grid in random order, as long as the solution stays unique.
+    # Returns the puzzle grid and its solution.
+    solution = random_grid(base, block_w, block_h, rng)
+    grid = [list(row) for row in solution]
+    cells = [(y, x) for y in range(base) for x in range(base)]
+    rng.shuffle(cells)
+    # the exact cover matrix is built once and reused for every check
+    matrix = ExactCover(base, block_w, block_h)
+    for y, x in cells:
+        n = grid[y][x]
+        # the solution stays unique if no other number fits at x, y
+        grid[y][x] = set(range(1, base+1)) - {n}
+        if count_solutions(grid, base, block_w, block_h, 1, matrix):
+            grid[y][x] = n
+        else:
+            grid[y][x] = 0
+    return grid, solution
+
+def rate_puzzle(grid, base, block_w, block_h):
+    # Rate the difficulty of a puzzle with a unique solution:
+    # "easy" if naked and hidden singles solve it, "medium" if the deduction
+    # rules are needed too, "hard" if guessing is needed.
+    for rating, rules in (("easy", ()), ("medium", ALL_RULES)):
+        trial = [list(row) for row in grid]
+        deduce(trial, base, block_w, block_h, rules, verbose=False)
+        if not any(isinstance(cell, set) for row in trial for cell in row):
+            return rating
+    return "hard"
+
+def generate_file(path, count, base=9, block_w=None, block_h=None, seed=None):
+    # Write count generated puzzles to the file at path, one per line in the
+    # format read by solve_file, each followed by a comment with the number of
+    # clues and the difficulty rating.
+    if block_w is None or block_h is None:
+        block_w, block_h = block_size(base)
+    rng = random.Random(seed)
+    with open(path, "w") as f:
+        for i in range(count):
+            grid, solution = generate_puzzle(base, block_w, block_h, rng)
+            clues = sum(1 for row in grid for cell in row if cell != 0)
+            f.write("{} # {} clues, {}\n".format(format_puzzle(grid), clues, rate_puzzle(grid, base, block_w, block_h)))
+
 if __name__ == "__main__":
-    precheck()
-    solve()
+    if len(sys.argv) > 1:
+        # batch mode, arguments are the puzzle file and optionally the output file
+        solved, failed = solve_file(*sys.argv[1:3])
+        sys.stderr.write("{} puzzles solved, {} failed\n".format(solved, failed))
+    else:
+        precheck()
+        solve()
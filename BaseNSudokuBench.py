@@ -0,0 +1,211 @@
+"""Benchmark for BaseNSudoku. Runs precheck() and solve() with every engine
+on a fixed corpus of grids of different sizes, prints the median and 95th
+percentile time and the peak memory use for each size and engine, and writes
+the results as JSON so they can be compared across versions.
+
+Usage: BaseNSudokuBench.py [output.json] [puzzles per size]
+"""
+
+from __future__ import division, print_function
+
+import json
+import math
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import BaseNSudoku
+
+# (base, block width, block height) of the benchmarked grids
+SIZES = [
+    (4, 2, 2),
+    (6, 3, 2),
+    (9, 3, 3),
+    (12, 4, 3),
+    (16, 4, 4),
+    (25, 5, 5),
+]
+
+# (name, ENGINE, SEARCH) of the benchmarked solver configurations
+CONFIGS = [
+    ("sets", "sets", False),
+    ("bitmask", "bitmask", False),
+    ("bitmask+search", "bitmask", True),
+    ("worklist", "worklist", False),
+    ("dlx", "dlx", False),
+]
+
+# fraction of cells that are given in the corpus puzzles
+CLUE_RATIO = 0.45
+
+# clue ratios for bases whose puzzles would be too hard for the search engines
+# with CLUE_RATIO, at 0.5 25x25 puzzles take minutes with dlx and search
+CLUE_RATIOS = {25: 0.55}
+
+# seconds after which a case is stopped and reported as timed out
+TIMEOUT = 60
+
+# seed of the corpus, changing it makes results incomparable to older ones
+SEED = 0
+
+def make_corpus(base, block_w, block_h, count, seed=SEED):
+    # Return count puzzle strings, made by removing random cells from random
+    # full grids. The puzzles are not necessarily unique, but always solvable.
+    rng = random.Random("{}-{}x{}-{}".format(seed, block_w, block_h, base))
+    corpus = []
+    for i in range(count):
+        grid = BaseNSudoku.random_grid(base, block_w, block_h, rng)
+        ratio = CLUE_RATIOS.get(base, CLUE_RATIO)
+        grid = [[cell if rng.random() < ratio else 0 for cell in row] for row in grid]
+        corpus.append(BaseNSudoku.format_puzzle(grid))
+    return corpus
+
+def max_rss():
+    # Return the peak resident memory of this process in KiB
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on Darwin (Mac and iOS) and in KiB elsewhere
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+def percentile(values, p):
+    # Return the p-th percentile of values (nearest rank method)
+    values = sorted(values)
+    return values[max(0, int(math.ceil(p / 100 * len(values))) - 1)]
+
+def run_case(puzzles, base, block_w, block_h, engine, search):
+    # Time precheck() and solve() on all puzzles with the given settings.
+    # Returns lists of precheck and solve times in seconds, the peak memory
+    # use and its increase during the case in KiB.
+    BaseNSudoku.BASE = base
+    BaseNSudoku.BLOCK_WIDTH = block_w
+    BaseNSudoku.BLOCK_HEIGHT = block_h
+    BaseNSudoku.ENGINE = engine
+    BaseNSudoku.SEARCH = search
+    BaseNSudoku.MAX_SOLUTIONS = 1
+    BaseNSudoku.QUIET = True
+
+    precheck_times = []
+    solve_times = []
+    rss_before = max_rss()
+    stdout = sys.stdout
+    # the solver's output is not part of the benchmark
+    with open(os.devnull, "w") as devnull:
+        sys.stdout = devnull
+        try:
+            for puzzle in puzzles:
+                BaseNSudoku.field = BaseNSudoku.parse_puzzle(puzzle, block_w, block_h)[0]
+                start = time.time()
+                BaseNSudoku.precheck()
+                checked = time.time()
+                BaseNSudoku.solve()
+                precheck_times.append(checked - start)
+                solve_times.append(time.time() - checked)
+        finally:
+            sys.stdout = stdout
+
+    rss_after = max_rss()
+    return precheck_times, solve_times, rss_after, rss_after - rss_before
+
+def run_case_isolated(args, timeout=TIMEOUT):
+    # Run run_case(*args) in a fresh interpreter, so that its peak memory is
+    # not inherited from this process as it would be in a forked one. The
+    # arguments and results are passed as JSON. Returns None if the case took
+    # longer than timeout seconds.
+    with tempfile.TemporaryFile() as output:
+        child = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--case"],
+                                 stdin=subprocess.PIPE, stdout=output)
+        child.stdin.write(json.dumps(args).encode("utf-8"))
+        child.stdin.close()
+        deadline = time.time() + timeout
+        while child.poll() is None:
+            if time.time() > deadline:
+                child.kill()
+                child.wait()
+                return None
+            time.sleep(0.05)
+        if child.returncode != 0:
+            raise RuntimeError("benchmark case failed with exit code {}".format(child.returncode))
+        output.seek(0)
+        return json.loads(output.read().decode("utf-8"))
+
+def benchmark(count=10, sizes=SIZES, configs=CONFIGS, isolate=True, timeout=TIMEOUT):
+    # Run all configs on count puzzles of each size and return a list of
+    # result dicts. With isolate, every case runs in a fresh interpreter, so
+    # that the memory use of one case does not hide that of the next, and
+    # cases taking longer than timeout seconds are stopped. Where no new
+    # interpreter can be started, cases run in this process instead.
+    results = []
+    for base, block_w, block_h in sizes:
+        puzzles = make_corpus(base, block_w, block_h, count)
+        for name, engine, search in configs:
+            result = {
+                "size": "{}x{}".format(base, base),
+                "base": base,
+                "block_width": block_w,
+                "block_height": block_h,
+                "engine": name,
+                "puzzles": len(puzzles),
+                "timed_out": False,
+            }
+            results.append(result)
+
+            args = (puzzles, base, block_w, block_h, engine, search)
+            if isolate:
+                try:
+                    case = run_case_isolated(args, timeout)
+                except OSError:
+                    # no subprocesses (e. g. in Pythonista), memory use is
+                    # measured in this process from now on
+                    print("Can't start a new interpreter, running cases in this process")
+                    isolate = False
+            if isolate:
+                if case is None:
+                    result["timed_out"] = True
+                    print("{size:>7} {engine:<15} timed out after {timeout} s".format(timeout=timeout, **result))
+                    continue
+                precheck_times, solve_times, rss, rss_increase = case
+            else:
+                precheck_times, solve_times, rss, rss_increase = run_case(*args)
+
+            result.update({
+                "precheck_median": percentile(precheck_times, 50),
+                "precheck_p95": percentile(precheck_times, 95),
+                "solve_median": percentile(solve_times, 50),
+                "solve_p95": percentile(solve_times, 95),
+                "max_rss_kib": rss,
+                "max_rss_increase_kib": rss_increase,
+                "isolated": isolate,
+            })
+            print("{size:>7} {engine:<15} solve median {solve_median:8.4f} s, p95 {solve_p95:8.4f} s, "
+                  "precheck median {precheck_median:8.4f} s, memory {max_rss_kib} KiB (+{max_rss_increase_kib} KiB)".format(**result))
+            sys.stdout.flush()
+
+    return results
+
+def main(args):
+    out_path = args[0] if len(args) > 0 else "BaseNSudokuBench.json"
+    count = int(args[1]) if len(args) > 1 else 10
+
+    results = benchmark(count)
+    with open(out_path, "w") as f:
+        json.dump({
+            "python": sys.version,
+            "platform": sys.platform,
+            "seed": SEED,
+            "clue_ratio": CLUE_RATIO,
+            "clue_ratios": CLUE_RATIOS,
+            "timeout": TIMEOUT,
+            "time": time.time(),
+            "results": results,
+        }, f, indent=4, sort_keys=True)
+    print("Results written to " + out_path)
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--case"]:
+        # a single case for run_case_isolated
+        json.dump(run_case(*json.load(sys.stdin)), sys.stdout)
+    else:
+        main(sys.argv[1:])
@@ -38,25 +38,50 @@
 # The plugins folder needs to be moved into PATH along with the main script.
 ###############################################################################
 
+import binascii    # to parse hex search patterns
+import clipboard   # to copy checksums
 import collections # for the namedtuple fileinfo
 import console     # for Quick Look and Open In
+import ctypes      # for inotify on Linux
+import ctypes.util
 import datetime    # to format timestamps from os.stat()
 import editor      # to open files
 import errno       # for OSError codes
+import fnmatch     # for glob patterns in filename search
+import functools   # to pass arguments to ui.delay
+import hashlib     # for thumbnail cache file names
+import heapq       # to keep the first filename search results
 import os.path     # to navigate the file structure
 import Image       # for thumbnail creation
+import mmap        # to search file contents
 import pwd         # to get names for UIDs
+import re          # for glob patterns in filename search
+import select      # to wait for inotify events
 import shutil      # to copy files
 import sound       # to play audio files
 import stat        # to analyze stat results
 import sys         # for sys.argv
+import threading   # for background thumbnail generation
 import time        # to sleep in certain situations and avoid hangs
 import ui          # duh
+import weakref     # to not keep closed views alive from background threads
 import webbrowser  # to open HTML files
+import zipfile     # to zip selected files
+try:               # to store the filename search index
+    import cPickle as pickle
+except ImportError:
+    import pickle
 try:               # to save PIL images to string
     import cStringIO as StringIO
 except ImportError:
     import StringIO
+try:               # for fast directory listings
+    from os import scandir
+except ImportError:
+    try:           # backport for Python 2
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 def full_path(path):
     # Return absolute path with expanded ~s, input path assumed relative to cwd
@@ -70,6 +95,28 @@ def rel_to_app(path):
     # Return path relative to app bundle (~/Pythonista.app)
     return os.path.relpath(full_path(path), os.path.expanduser("~/Pythonista.app"))
 
+def on_main_thread(func, *args):
+    # Call func(*args) on the main thread, views must not be changed from
+    # background threads
+    ui.delay(functools.partial(func, *args), 0)
+
+def throttled(func):
+    # Return a function that calls func with its arguments, unless it already
+    # did less than PROGRESS_INTERVAL seconds ago, to limit progress updates
+    last_call = [0.0]
+    def _throttled(*args):
+        if time.time() - last_call[0] >= PROGRESS_INTERVAL:
+            last_call[0] = time.time()
+            return func(*args)
+    return _throttled
+
+def set_subtitle(actions, key, subtitle):
+    # Change the subtitle of the action with the given key in the list of
+    # (key, title, subtitle, icon) tuples actions
+    for i, action in enumerate(actions):
+        if action[0] == key:
+            actions[i] = action[:2] + (subtitle,) + action[3:]
+
 # get location of current script, fall back to ~ if necessary
 
 SCRIPT_ROOT = full_path("~") if sys.argv[0] == "prompt" else os.path.dirname(sys.argv[0])
@@ -77,6 +124,61 @@ SCRIPT_ROOT = full_path("~") if sys.argv[0] == "prompt" else os.path.dirname(sys
 if not os.path.exists(os.path.join(SCRIPT_ROOT, "temp")):
     os.mkdir(os.path.join(SCRIPT_ROOT, "temp"))
 
+# maximum number of FileItems kept by a FileDataSource for recently shown rows
+ROW_CACHE_SIZE = 256
+
+# maximum number of folder listings kept by list_names
+LISTING_CACHE_SIZE = 64
+
+# sort modes of file lists in the order they are switched through, and their titles
+SORT_MODES = ("name", "type", "size", "mtime")
+SORT_TITLES = {"name": "Name", "type": "Type", "size": "Size", "mtime": "Date"}
+
+# seconds between checks of open file lists for changes in their folders
+WATCH_INTERVAL = 1.0
+
+# minimum seconds between updates of progress shown while a task is running
+PROGRESS_INTERVAL = 0.25
+
+# folder and maximum total size in bytes of the thumbnail cache
+THUMBNAIL_CACHE_DIR = os.path.join(SCRIPT_ROOT, "temp", "thumbnails")
+THUMBNAIL_CACHE_SIZE = 8 * 1024 * 1024
+
+# number of threads generating thumbnails and maximum number of waiting
+# thumbnail requests, older requests are dropped when there are more
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_MAX_PENDING = 64
+
+# maximum number of folders whose size data is kept by scan_dir_usage
+DIR_USAGE_CACHE_SIZE = 16384
+
+# number of largest entries shown after calculating the size of a folder
+LARGEST_ENTRIES = 10
+
+# folder covered by the filename search, file in which its index is stored
+# and maximum number of search results shown
+SEARCH_ROOT = full_path("~")
+SEARCH_INDEX_FILE = os.path.join(SCRIPT_ROOT, "temp", "filenav-index.pkl")
+SEARCH_LIMIT = 200
+
+# file types searched by Search Contents, other types are treated as binary,
+# size of the chunks in which files are searched and maximum number of results
+GREP_TYPES = ("code", "code_tags", "text", "file")
+GREP_CHUNK_SIZE = 1024 * 1024
+GREP_LIMIT = 1000
+
+# size of the buffer used to copy and hash files
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# size of the first block compared by Find Duplicates before hashing whole
+# files, and maximum number of results kept by the checksum cache
+HEAD_SIZE = 64 * 1024
+CHECKSUM_CACHE_SIZE = 4096
+
+# number of bytes per row and row height of the hex viewer
+HEX_ROW_SIZE = 16
+HEX_ROW_HEIGHT = 24
+
 # list of file size units
 SIZE_SUFFIXES = "bytes KiB MiB GiB TiB PiB EiB ZiB YiB".split()
 
@@ -219,6 +321,12 @@ FILE_TYPES = {
               }
 FILE_TYPES = {k:tuple(v.split()) for k,v in FILE_TYPES.iteritems()}
 
+# reverse of FILE_TYPES, dict of file type groups for each extension
+FILE_TYPES_BY_EXT = {ext:k for k,v in FILE_TYPES.iteritems() for ext in v}
+
+# maximum number of results kept by get_file_info, the cache is cleared when full
+FILE_INFO_CACHE_SIZE = 4096
+
 # dict of descriptions and icons for all file type groups
 FILE_DESCS_ICONS = {
     "app":       ("Application",     "../FileUI"),
@@ -242,21 +350,35 @@ fileinfo = collections.namedtuple('fileinfo',
             'file_ext recognized_ext filetype filedesc icon')
 
 def get_filetype(file_ext):
-    for filetype, exts in FILE_TYPES.iteritems():
-        if file_ext in exts:
-            return filetype
-    return None
+    return FILE_TYPES_BY_EXT.get(file_ext)
+
+_file_info_cache = {}
 
-def get_file_info(filename):
+def get_file_info(filename, is_dir=None):
+    # is_dir can be passed if already known to avoid another os.path.isdir call,
+    # the result then only depends on the basename and is cached
     if not isinstance(filename, str):
         return fileinfo('', '', '', '', None)
+    if is_dir is None:
+        is_dir = os.path.isdir(filename)
+    key = (os.path.basename(filename), is_dir)
+    try:
+        return _file_info_cache[key]
+    except KeyError:
+        pass
+    if len(_file_info_cache) >= FILE_INFO_CACHE_SIZE:
+        _file_info_cache.clear()
+    info = _file_info_cache[key] = _make_file_info(key[0], is_dir)
+    return info
+
+def _make_file_info(basename, is_dir):
+    # Determine the fileinfo for a file or folder named basename
     recognized_ext_and_type = ('', '')
-    for ext in os.path.basename(filename.lower()).split("."):
+    for ext in basename.lower().split("."):
         filetype = get_filetype(ext)
         if filetype:
             recognized_ext_and_type = (ext, filetype)
     recognized_ext, filetype = recognized_ext_and_type
-    is_dir = os.path.isdir(filename)
     if not filetype:
         filetype = "folder" if is_dir else "file"
     desc, icon = FILE_DESCS_ICONS.get(filetype, ("", None))
@@ -267,56 +389,875 @@ def get_file_info(filename):
             icon = folder_icon
     return fileinfo(ext, recognized_ext, filetype, desc, icon)
 
-def get_thumbnail(path):
-    def path_to_thumbnail(path):
-        thumb = Image.open(path)
+class ThumbnailCache(object):
+    # on-disk cache of thumbnail image data, keyed by path, mtime and size
+    # of the original image. When the cache grows larger than max_size,
+    # the least recently used thumbnails are removed.
+    def __init__(self, folder, max_size):
+        # init
+        self.folder = folder
+        self.max_size = max_size
+        self.size = None  # total size of cached files, calculated on first put
+        self.lock = threading.Lock()
+
+    def cache_file(self, path, st):
+        # Return the cache file for path with the stat result st
+        key = hashlib.md5(repr((path, st.st_mtime, st.st_size))).hexdigest()
+        return os.path.join(self.folder, key)
+
+    def get(self, path, st):
+        # Return the cached thumbnail data for path, or None
+        cache_file = self.cache_file(path, st)
+        try:
+            with open(cache_file, "rb") as f:
+                data = f.read()
+        except IOError:
+            return None
+        try:  # mark as recently used
+            os.utime(cache_file, None)
+        except OSError:
+            pass
+        return data
+
+    def put(self, path, st, data):
+        # Store thumbnail data for path and evict old thumbnails if necessary
+        with self.lock:
+            if not os.path.isdir(self.folder):
+                os.makedirs(self.folder)
+            if self.size is None:
+                self.size = sum(os.path.getsize(os.path.join(self.folder, name))
+                                for name in os.listdir(self.folder))
+            with open(self.cache_file(path, st), "wb") as f:
+                f.write(data)
+            self.size += len(data)
+            if self.size > self.max_size:
+                self.evict(self.max_size * 3 // 4)
+
+    def evict(self, target_size):
+        # Remove least recently used thumbnails until at most target_size bytes are used
+        entries = []
+        for name in os.listdir(self.folder):
+            try:
+                st = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        entries.sort()
+        self.size = sum(size for mtime, size, name in entries)
+        for mtime, size, name in entries:
+            if self.size <= target_size:
+                break
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                continue
+            self.size -= size
+
+THUMBNAIL_CACHE = ThumbnailCache(THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_SIZE)
+
+def get_thumbnail(path, st=None):
+    # Return a 32x32 ui.Image thumbnail of the image at path, or None.
+    # st is the os.stat result of path, if already known.
+    def make_thumbnail_data(f):
+        thumb = Image.open(f)
+        # let the JPEG decoder downscale while loading, does nothing for other formats
+        thumb.draft(thumb.mode, (32, 32))
         thumb.thumbnail((32, 32), Image.ANTIALIAS)
         strio = StringIO.StringIO()
         thumb.save(strio, thumb.format)
         data = strio.getvalue()
         strio.close()
-        return ui.Image.from_data(data)
+        return data
 
-    try:  # attempt to generate a thumbnail
-        return path_to_thumbnail(path)
-    except IOError as err:
-        if not err.message == "broken data stream when reading image file":
+    if st is None:
+        try:
+            st = os.stat(path)
+        except OSError:
             return None
-        tmp_file = os.path.join(SCRIPT_ROOT, "temp/filenav-tmp.png")
-        # write image as png using ui module
+
+    data = THUMBNAIL_CACHE.get(path, st)
+    if data is None:
+        try:  # attempt to generate a thumbnail
+            data = make_thumbnail_data(path)
+        except IOError as err:
+            if not err.message == "broken data stream when reading image file":
+                return None
+            # decode the image using ui module instead
+            data = make_thumbnail_data(StringIO.StringIO(ui.Image.named(path).to_png()))
+        THUMBNAIL_CACHE.put(path, st, data)
+    return ui.Image.from_data(data)
+
+class ThumbnailLoader(object):
+    # generates thumbnails on a fixed number of background threads. The newest
+    # request is handled first, as it most likely belongs to a row that is
+    # currently shown. Requests can be cancelled until a thread picks them up.
+    def __init__(self, workers, max_pending):
+        # init
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = collections.OrderedDict()  # path -> (stat result, callback)
+        self.cond = threading.Condition()
+        self.threads = []
+
+    def request(self, path, st, callback):
+        # Generate a thumbnail for path in the background and call callback
+        # with it, or with None if no thumbnail could be created
+        with self.cond:
+            self.pending.pop(path, None)
+            self.pending[path] = (st, callback)
+            while len(self.pending) > self.max_pending:
+                self.pending.popitem(last=False)
+            if len(self.threads) < self.workers:
+                thread = threading.Thread(target=self.run)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+            self.cond.notify()
+
+    def cancel(self, path):
+        # Cancel the request for path if it is still waiting
+        with self.cond:
+            self.pending.pop(path, None)
+
+    def run(self):
+        # worker thread loop
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                path, (st, callback) = self.pending.popitem()
+            try:
+                thumb = get_thumbnail(path, st)
+            except Exception:
+                thumb = None
+            callback(thumb)
+
+THUMBNAIL_LOADER = ThumbnailLoader(THUMBNAIL_WORKERS, THUMBNAIL_MAX_PENDING)
+
+def list_dir(path):
+    # Return a list of FileItems for the contents of the directory at path,
+    # reusing the type and stat data of os.scandir where available.
+    # Only FileItem.contents uses this, file lists get their names from
+    # list_names and create FileItems for visible rows only.
+    if scandir is not None:
+        return [FileItem(entry.path, entry) for entry in scandir(path)]
+    else:
+        return [FileItem(os.path.join(path, name)) for name in os.listdir(path)]
+
+def scan_names(path):
+    # Return lists of the names of folders and files in the directory
+    # at path, without creating FileItems or calling stat where possible
+    folders = []
+    files = []
+    if scandir is not None:
+        for entry in scandir(path):
+            (folders if entry.is_dir() else files).append(entry.name)
+    else:
+        for name in os.listdir(path):
+            (folders if os.path.isdir(os.path.join(path, name)) else files).append(name)
+    return folders, files
+
+_listing_cache = collections.OrderedDict()
+_listing_lock = threading.Lock()
+
+def list_names(path):
+    # Like scan_names, but the result is cached by real path and reused
+    # as long as the folder's mtime does not change
+    path = os.path.realpath(path)
+    mtime = os.stat(path).st_mtime
+    with _listing_lock:
+        cached = _listing_cache.pop(path, None)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime,) + scan_names(path)
+    with _listing_lock:
+        _listing_cache[path] = cached
+        while len(_listing_cache) > LISTING_CACHE_SIZE:
+            _listing_cache.popitem(last=False)
+    # return copies, the cached lists are shared by all callers
+    return list(cached[1]), list(cached[2])
+
+def stat_names(path, names):
+    # Return a dict of (size, mtime) for the given names in the folder at path,
+    # entries that can't be stat'ed get (0, 0)
+    stats = {}
+    for name in names:
+        try:
+            st = os.stat(os.path.join(path, name))
+        except OSError:
+            stats[name] = (0, 0)
+        else:
+            stats[name] = (st.st_size, st.st_mtime)
+    return stats
+
+_dir_usage_cache = collections.OrderedDict()
+_dir_usage_lock = threading.Lock()
+
+def scan_dir_usage(path):
+    # Return the total size and number of the files directly in the folder at
+    # path and a list of its subfolders. The result is cached and reused as
+    # long as the folder's mtime does not change. Symlinks are not followed.
+    st = os.lstat(path)
+    with _dir_usage_lock:
+        cached = _dir_usage_cache.pop(path, None)
+    if cached is None or cached[0] != st.st_mtime:
+        size = 0
+        files = 0
+        subdirs = []
+        if scandir is not None:
+            for entry in scandir(path):
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                    continue
+                try:
+                    size += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+                files += 1
+        else:
+            for name in os.listdir(path):
+                try:
+                    entry_st = os.lstat(os.path.join(path, name))
+                except OSError:
+                    continue
+                if stat.S_ISDIR(entry_st.st_mode):
+                    subdirs.append(os.path.join(path, name))
+                else:
+                    size += entry_st.st_size
+                    files += 1
+        cached = (st.st_mtime, size, files, subdirs)
+    with _dir_usage_lock:
+        _dir_usage_cache[path] = cached
+        while len(_dir_usage_cache) > DIR_USAGE_CACHE_SIZE:
+            _dir_usage_cache.popitem(last=False)
+    return cached[1:]
+
+def dir_usage(path, progress=None):
+    # Return the total size in bytes and number of files in the folder at path
+    # and all subfolders, and a list of (size, name) of its entries, largest
+    # first. progress is called with the size and file count so far after
+    # every folder. Unreadable folders are skipped.
+    total = 0
+    files = 0
+    entries = []
+    for name in os.listdir(path):
+        entry_path = os.path.join(path, name)
+        try:
+            st = os.lstat(entry_path)
+        except OSError:
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            size = 0
+            count = 0
+            stack = [entry_path]
+            while stack:
+                try:
+                    dir_size, dir_files, subdirs = scan_dir_usage(stack.pop())
+                except OSError:
+                    continue
+                size += dir_size
+                count += dir_files
+                stack.extend(subdirs)
+                if progress:
+                    progress(total + size, files + count)
+        else:
+            size = st.st_size
+            count = 1
+        total += size
+        files += count
+        entries.append((size, name))
+    entries.sort(reverse=True)
+    return total, files, entries
+
+searchresult = collections.namedtuple('searchresult',
+            'path name filetype size mtime isdir')
+
+class FileIndex(object):
+    # persistent index of the names of all files and folders under root, so
+    # they can be searched without walking the file system. For every folder,
+    # its mtime and a list of (name, lowercase name, filetype, size, mtime,
+    # isdir) of its entries are stored.
+    def __init__(self, root, index_file):
+        # init
+        self.root = root
+        self.index_file = index_file
+        self.dirs = {}
+        self.lock = threading.Lock()  # held while updating
+        self.load()
+
+    def load(self):
+        # Load the index from index_file, a missing or broken file is ignored
+        try:
+            with open(self.index_file, "rb") as f:
+                root, dirs = pickle.load(f)
+        except Exception:
+            return
+        if root == self.root:
+            self.dirs = dirs
+
+    def save(self):
+        # Save the index to index_file
+        tmp_file = self.index_file + ".tmp"
         with open(tmp_file, "wb") as f:
-            f.write(ui.Image.named(path).to_png())
-        return path_to_thumbnail(tmp_file)
+            pickle.dump((self.root, self.dirs), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_file, self.index_file)
+
+    def scan(self, path):
+        # Return a list of index entries for the folder at path
+        entries = []
+        if scandir is not None:
+            for entry in scandir(path):
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                entries.append(self.make_entry(entry.name, st))
+        else:
+            for name in os.listdir(path):
+                try:
+                    st = os.lstat(os.path.join(path, name))
+                except OSError:
+                    continue
+                entries.append(self.make_entry(name, st))
+        return entries
+
+    def make_entry(self, name, st):
+        # Return an index entry for a file named name with the lstat result st
+        isdir = stat.S_ISDIR(st.st_mode)
+        return (name, name.lower(), get_file_info(name, isdir).filetype,
+                st.st_size, st.st_mtime, isdir)
+
+    def update(self, progress=None):
+        # Bring the index up to date. Only folders whose mtime changed since
+        # the last update are listed again. progress is called with the number
+        # of folders checked so far.
+        with self.lock:
+            new_dirs = {}
+            stack = [self.root]
+            while stack:
+                path = stack.pop()
+                try:
+                    mtime = os.lstat(path).st_mtime
+                except OSError:
+                    continue
+                cached = self.dirs.get(path)
+                if cached is None or cached[0] != mtime:
+                    try:
+                        cached = (mtime, self.scan(path))
+                    except OSError:
+                        continue
+                new_dirs[path] = cached
+                stack.extend(os.path.join(path, entry[0]) for entry in cached[1] if entry[5])
+                if progress:
+                    progress(len(new_dirs))
+            self.dirs = new_dirs
+            self.save()
+
+    def search(self, query, limit=None):
+        # Return a list of searchresults for the names matching query, sorted
+        # by path. A query starting with a dot is an extension, one containing
+        # *, ? or [ a glob pattern, anything else is searched for as a part of
+        # the name. Case is ignored.
+        query = query.strip().lower()
+        if not query:
+            return []
+        if any(c in query for c in "*?["):
+            match = re.compile(fnmatch.translate(query)).match
+        elif query.startswith("."):
+            match = lambda name: name.endswith(query)
+        else:
+            match = lambda name: query in name
+        results = (searchresult(os.path.join(path, name), name, filetype, size, entry_mtime, isdir)
+                   for path, (mtime, entries) in self.dirs.iteritems()
+                   for name, name_lower, filetype, size, entry_mtime, isdir in entries
+                   if match(name_lower))
+        if limit is None:
+            return sorted(results)
+        # the first limit results by path, not the first ones found
+        return heapq.nsmallest(limit, results)
+
+_search_index = None
+
+def get_search_index():
+    # Return the FileIndex for SEARCH_ROOT, loading it on first use
+    global _search_index
+    if _search_index is None:
+        _search_index = FileIndex(SEARCH_ROOT, SEARCH_INDEX_FILE)
+    return _search_index
+
+def iter_files(path):
+    # Yield the paths of all files in the folder at path and its subfolders.
+    # Symlinks to folders are not followed, unreadable folders are skipped.
+    stack = [path]
+    while stack:
+        folder = stack.pop()
+        try:
+            if scandir is not None:
+                entries = [(entry.path, entry.is_dir(follow_symlinks=False))
+                           for entry in scandir(folder)]
+            else:
+                entries = [(os.path.join(folder, name), os.path.isdir(os.path.join(folder, name))
+                            and not os.path.islink(os.path.join(folder, name)))
+                           for name in os.listdir(folder)]
+        except OSError:
+            continue
+        for entry_path, isdir in sorted(entries, reverse=True):
+            if isdir:
+                stack.append(entry_path)
+            else:
+                yield entry_path
+
+grepresult = collections.namedtuple('grepresult', 'path lineno line')
+
+def grep_file(path, regex):
+    # Yield (line number, line) for every line of the file at path that
+    # matches regex. The file is memory-mapped and searched in chunks of
+    # whole lines. Files containing a null byte in the first chunk are
+    # considered binary and skipped.
+    with open(path, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):  # empty file or no regular file
+            return
+        try:
+            size = len(data)
+            if data.find("\0", 0, GREP_CHUNK_SIZE) != -1:
+                return
+            lineno = 1
+            pos = 0
+            while pos < size:
+                end = min(pos + GREP_CHUNK_SIZE, size)
+                if end < size:
+                    newline = data.rfind("\n", pos, end)
+                    if newline != -1:  # otherwise split the very long line
+                        end = newline + 1
+                chunk = data[pos:end]
+                counted = 0    # position up to which lines were counted
+                next_line = 0  # start of the line after the last match
+                for match in regex.finditer(chunk):
+                    if match.start() < next_line:
+                        continue
+                    line_start = chunk.rfind("\n", 0, match.start()) + 1
+                    line_end = chunk.find("\n", match.start())
+                    if line_end == -1:
+                        line_end = len(chunk)
+                    lineno += chunk.count("\n", counted, line_start)
+                    counted = line_start
+                    next_line = line_end + 1
+                    yield lineno, chunk[line_start:line_end]
+                lineno += chunk.count("\n", counted)
+                pos = end
+        finally:
+            data.close()
+
+def grep_tree(path, query, cancelled=None):
+    # Yield grepresults for all lines containing query (ignoring case) in the
+    # text files in the folder at path and its subfolders. If cancelled is
+    # given, it is called before each file and the search stops once it
+    # returns True.
+    if isinstance(query, unicode):
+        # the files are searched as UTF-8 bytes
+        query = query.encode("utf-8")
+    regex = re.compile(re.escape(query), re.IGNORECASE)
+    for file_path in iter_files(path):
+        if cancelled is not None and cancelled():
+            return
+        if get_file_info(file_path, False).filetype not in GREP_TYPES:
+            continue
+        try:
+            for lineno, line in grep_file(file_path, regex):
+                yield grepresult(file_path, lineno, line.strip().decode("utf-8", "replace"))
+        except EnvironmentError:
+            continue
+
+def file_hash(path, progress=None):
+    # Return the SHA-1 hex digest of the contents of the file at path.
+    # progress is called with the number of bytes hashed after every chunk.
+    # If it returns True, hashing is cancelled and None is returned.
+    digest = hashlib.sha1()
+    hashed = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(COPY_BUFFER_SIZE), ""):
+            digest.update(chunk)
+            hashed += len(chunk)
+            if progress and progress(hashed):
+                return None
+    return digest.hexdigest()
+
+checksums = collections.namedtuple('checksums', 'md5 sha1 sha256')
+
+_checksum_cache = collections.OrderedDict()
+_checksum_lock = threading.Lock()
+
+def cached_checksum(kind, path, st, func):
+    # Return func(path) for the file at path with the os.stat result st. The
+    # result is cached by kind, inode, mtime and size, unless it is None
+    # (e. g. because func was cancelled).
+    key = (kind, st.st_dev, st.st_ino, st.st_mtime, st.st_size)
+    with _checksum_lock:
+        result = _checksum_cache.pop(key, None)
+    if result is None:
+        result = func(path)
+        if result is None:
+            return None
+    with _checksum_lock:
+        _checksum_cache[key] = result
+        while len(_checksum_cache) > CHECKSUM_CACHE_SIZE:
+            _checksum_cache.popitem(last=False)
+    return result
+
+def _file_checksums(path):
+    # Compute the checksums of the file at path in a single pass
+    digests = [hashlib.md5(), hashlib.sha1(), hashlib.sha256()]
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(COPY_BUFFER_SIZE), ""):
+            for digest in digests:
+                digest.update(chunk)
+    return checksums(*[digest.hexdigest() for digest in digests])
+
+def file_checksums(path, st=None):
+    # Return the MD5, SHA-1 and SHA-256 checksums of the file at path.
+    # st is the os.stat result of path, if already known.
+    return cached_checksum("full", path, st or os.stat(path), _file_checksums)
+
+def _head_hash(path):
+    # Compute the MD5 digest of the first HEAD_SIZE bytes of the file at path
+    with open(path, "rb") as f:
+        return hashlib.md5(f.read(HEAD_SIZE)).hexdigest()
+
+def find_duplicates(path, progress=None):
+    # Return a list of (size, paths) for groups of files with the same
+    # contents in the folder at path and its subfolders, the group wasting
+    # the most space first. Files are grouped by size first, then by a hash
+    # of their first block and only then by a hash of their whole contents,
+    # so only files that are likely duplicates are read completely. Empty
+    # files and additional hard links to a file are ignored. progress is
+    # called with a description of the current step.
+    groups = collections.defaultdict(list)
+    inodes = set()
+    for count, file_path in enumerate(iter_files(path)):
+        try:
+            st = os.lstat(file_path)
+        except OSError:
+            continue
+        if not stat.S_ISREG(st.st_mode) or st.st_size == 0 or (st.st_dev, st.st_ino) in inodes:
+            continue
+        inodes.add((st.st_dev, st.st_ino))
+        groups[st.st_size].append((file_path, st))
+        if progress and count % 100 == 0:
+            progress("Comparing sizes, {} files".format(count))
+
+    def _split(groups, step, digest):
+        # Split every group of more than one file by digest(path, stat result)
+        candidates = [group for group in groups if len(group) > 1]
+        result = []
+        for i, group in enumerate(candidates):
+            if progress:
+                progress("{}, {}/{}".format(step, i, len(candidates)))
+            by_digest = collections.defaultdict(list)
+            for file_path, st in group:
+                try:
+                    by_digest[digest(file_path, st)].append((file_path, st))
+                except EnvironmentError:
+                    continue
+            result.extend(by_digest.itervalues())
+        return result
+
+    groups = _split(groups.values(), "Comparing first blocks",
+                    lambda file_path, st: cached_checksum("head", file_path, st, _head_hash))
+    # files no larger than HEAD_SIZE were already compared completely
+    groups = _split(groups, "Comparing contents",
+                    lambda file_path, st: st.st_size <= HEAD_SIZE or file_checksums(file_path, st))
+    duplicates = [(group[0][1].st_size, sorted(file_path for file_path, st in group))
+                  for group in groups if len(group) > 1]
+    # most wasted space first
+    duplicates.sort(key=lambda dup: (-dup[0] * (len(dup[1]) - 1), dup[1]))
+    return duplicates
+
+def files_identical(src, dst, src_st=None, progress=None):
+    # Check if dst is a copy of src with the same size, mtime and contents.
+    # src_st is the os.stat result of src, if already known. The hash of src
+    # is cached, so an unchanged source is only read once. progress is called with the number of bytes hashed and the total
+    # after every chunk. If it returns True, the check is cancelled and None
+    # is returned.
+    try:
+        dst_st = os.stat(dst)
+    except OSError:
+        return False
+    if src_st is None:
+        src_st = os.stat(src)
+    if dst_st.st_size != src_st.st_size or int(dst_st.st_mtime) != int(src_st.st_mtime):
+        return False
+    total = src_st.st_size + dst_st.st_size
+
+    def _hasher(offset):
+        # file_hash reporting progress after offset bytes of both files
+        if progress is None:
+            return file_hash
+        return lambda path: file_hash(path, lambda hashed: progress(offset + hashed, total))
+
+    src_hash = cached_checksum("sha1", src, src_st, _hasher(0))
+    if src_hash is None:
+        return None
+    dst_hash = _hasher(src_st.st_size)(dst)
+    if dst_hash is None:
+        return None
+    return src_hash == dst_hash
+
+def copy_chunks(fsrc, fdst):
+    # Copy the open file fsrc to fdst and yield the number of bytes copied
+    # so far after every chunk. Uses sendfile where it supports regular files.
+    copied = 0
+    if hasattr(os, "sendfile") and sys.platform.startswith("linux"):
+        fdst.flush()
+        while True:
+            count = os.sendfile(fdst.fileno(), fsrc.fileno(), None, COPY_BUFFER_SIZE)
+            if not count:
+                break
+            copied += count
+            yield copied
+    else:
+        while True:
+            chunk = fsrc.read(COPY_BUFFER_SIZE)
+            if not chunk:
+                break
+            fdst.write(chunk)
+            copied += len(chunk)
+            yield copied
+
+def copy_file(src, dst, progress=None):
+    # Copy the file src to dst including mode and mtime, unless dst is already
+    # an identical copy. progress is called with the number of bytes done, the
+    # total and the step ("Comparing" or "Copying") after every chunk. If it
+    # returns True, the copy is cancelled and the incomplete dst is removed.
+    # Returns False if the copy was cancelled, True otherwise.
+    src_st = os.stat(src)
+    identical = files_identical(src, dst, src_st,
+                                progress and (lambda done, total: progress(done, total, "Comparing")))
+    if identical is None:
+        return False
+    elif identical:
+        return True
+    cancelled = False
+    with open(src, "rb") as fsrc:
+        with open(dst, "wb") as fdst:
+            for copied in copy_chunks(fsrc, fdst):
+                if progress and progress(copied, src_st.st_size, "Copying"):
+                    cancelled = True
+                    break
+    if cancelled:
+        os.remove(dst)
+        return False
+    shutil.copymode(src, dst)
+    # keep the mtime so files_identical can recognize the copy later
+    os.utime(dst, (src_st.st_atime, src_st.st_mtime))
+    return True
+
+def unique_path(path):
+    # Return path, or if it exists path with the lowest number added before
+    # the extension that doesn't exist
+    base, ext = os.path.splitext(path)
+    i = 2
+    while os.path.lexists(path):
+        path = "{} {}{}".format(base, i, ext)
+        i += 1
+    return path
+
+def walk_tree(path):
+    # Yield (path, isdir) for path and, if it is a folder, everything in it,
+    # folders before their contents. Symlinks to folders are not followed and
+    # yielded like files, callers have to check for links with os.path.islink.
+    stack = [(path, os.path.isdir(path) and not os.path.islink(path))]
+    while stack:
+        current, isdir = stack.pop()
+        yield current, isdir
+        if not isdir:
+            continue
+        try:
+            if scandir is not None:
+                entries = [(entry.path, entry.is_dir(follow_symlinks=False))
+                           for entry in scandir(current)]
+            else:
+                entries = [(os.path.join(current, name), os.path.isdir(os.path.join(current, name))
+                            and not os.path.islink(os.path.join(current, name)))
+                           for name in os.listdir(current)]
+        except OSError:
+            continue
+        stack.extend(sorted(entries, reverse=True))
+
+def is_inside(path, folder):
+    # Check if path is folder or inside it
+    path, folder = os.path.realpath(path), os.path.realpath(folder)
+    return path == folder or path.startswith(folder.rstrip(os.sep) + os.sep)
+
+class BulkOperation(object):
+    # copies, moves, deletes or zips many files and folders at once. Every
+    # item is handled in a single pass, and the aggregate progress is kept in
+    # the *_done attributes so it can be shown while run() is running on a
+    # worker thread. progress, if set, is called with the operation after
+    # every item and copied file. Setting cancelled stops the operation.
+    def __init__(self, op, paths, dest=None):
+        # init, op is "copy", "move", "delete" or "zip". Copied and moved
+        # items are put in the folder dest, zipped ones in the archive dest.
+        self.op = op
+        self.paths = list(paths)
+        self.dest = dest
+        self.progress = None
+        self.items_done = 0
+        self.files_done = 0
+        self.bytes_done = 0
+        self.errors = []  # (path, error message)
+        self.cancelled = False
+
+    def report(self):
+        # Call progress, if set
+        if self.progress:
+            self.progress(self)
+
+    def run(self):
+        # Handle all items
+        if self.op == "zip":
+            archive = zipfile.ZipFile(self.dest, "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+        else:
+            archive = None
+        try:
+            for path in self.paths:
+                if self.cancelled:
+                    break
+                try:
+                    if self.op == "delete":
+                        self.delete(path)
+                    elif self.op == "move":
+                        self.move(path)
+                    elif self.op == "copy":
+                        self.copy(path, unique_path(os.path.join(self.dest, os.path.basename(path))))
+                    elif self.op == "zip":
+                        self.zip(path, archive)
+                except (EnvironmentError, shutil.Error) as err:
+                    self.errors.append((path, getattr(err, "strerror", None) or str(err)))
+                self.items_done += 1
+                self.report()
+        finally:
+            if archive is not None:
+                archive.close()
+
+    def delete(self, path):
+        # Delete the file or folder at path
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+    def move(self, path):
+        # Move the file or folder at path into dest, copying it if it is
+        # on a different file system. Symlinks are moved as links.
+        if not os.path.islink(path) and is_inside(self.dest, path):
+            raise OSError(errno.EINVAL, "Can't move a folder into itself")
+        if os.path.realpath(os.path.dirname(path)) == os.path.realpath(self.dest):
+            return  # already there
+        target = unique_path(os.path.join(self.dest, os.path.basename(path)))
+        try:
+            os.rename(path, target)
+        except OSError as err:
+            if err.errno != errno.EXDEV:
+                raise
+            self.copy(path, target)
+            if not self.cancelled:
+                self.delete(path)
+
+    def copy(self, path, target):
+        # Copy the file or folder at path to target. Symlinks are copied as
+        # links, so a link to a folder can be inside it.
+        if not os.path.islink(path) and is_inside(self.dest, path):
+            raise OSError(errno.EINVAL, "Can't copy a folder into itself")
+        for src, isdir in walk_tree(path):
+            if self.cancelled:
+                return
+            dst = target if src == path else os.path.join(target, os.path.relpath(src, path))
+            if isdir:
+                os.mkdir(dst)
+            elif os.path.islink(src):
+                # links are copied as links, links to folders can't be opened
+                os.symlink(os.readlink(src), dst)
+                self.files_done += 1
+                self.report()
+            else:
+                copied_before = self.bytes_done
+                def _progress(done, total, step):
+                    if step == "Copying":
+                        self.bytes_done = copied_before + done
+                    return self.cancelled
+                copy_file(src, dst, _progress)
+                self.files_done += 1
+                self.report()
+
+    def zip(self, path, archive):
+        # Add the file or folder at path to archive
+        root = os.path.dirname(path)
+        for src, isdir in walk_tree(path):
+            if self.cancelled:
+                return
+            if os.path.islink(src):
+                # links are stored as links, like zip -y does
+                info = zipfile.ZipInfo(os.path.relpath(src, root))
+                info.create_system = 3  # Unix, so the mode is read when extracting
+                info.external_attr = (stat.S_IFLNK | 0o777) << 16
+                archive.writestr(info, os.readlink(src))
+            elif not isdir and os.path.realpath(src) == os.path.realpath(self.dest):
+                continue  # don't add the archive to itself
+            else:
+                archive.write(src, os.path.relpath(src, root))
+            if not isdir:
+                self.files_done += 1
+                self.bytes_done += os.lstat(src).st_size
+                self.report()
 
 class FileItem(object):
     # object representation of a file and its properties
-    def __init__(self, path):
-        # init
+    def __init__(self, path, entry=None):
+        # init, entry is an optional os.scandir DirEntry for path
         self.path = path
-        self.refresh()
+        self.refresh(entry)
 
-    def refresh(self):
-        # refresh all properties
-        self.path = full_path(self.path)
-        self.fileinfo = get_file_info(self.path)
+    def refresh(self, entry=None):
+        # refresh all properties, the contents of folders are listed on first use
+        if entry is not None and not entry.is_symlink():
+            # path is already absolute and free of symlinks, use cached stat data
+            try:
+                self.stat = entry.stat()
+            except OSError as err:
+                self.stat = err
+        else:
+            self.path = full_path(self.path)
+            try:
+                self.stat = os.stat(self.path)
+            except OSError as err:
+                self.stat = err
+        is_dir = not isinstance(self.stat, OSError) and stat.S_ISDIR(self.stat.st_mode)
+
+        self.fileinfo = get_file_info(self.path, is_dir)
         self.icon = self.fileinfo.icon
         self.icon_cached = False
-        self.rel_to_docs = rel_to_docs(self.path)
+        self.rel_to_docs = os.path.relpath(self.path, os.path.expanduser("~/Documents"))
         self.location, self.name = os.path.split(self.path)
-        try:
-            self.stat = os.stat(self.path)
-        except OSError as err:
-            self.stat = err
+        self.basetype = 0 if is_dir else 1
+        self._contents = None
+
+    @property
+    def contents(self):
+        # list of FileItems in this folder, or OSError if it can't be listed
+        if self._contents is None:
+            if self.isdir():
+                try:
+                    self._contents = list_dir(self.path)
+                except OSError as err:
+                    self._contents = err
+            else:
+                self._contents = []
+        return self._contents
 
-        if os.path.isdir(self.path):
-            self.basetype = 0
-            try:
-                self.contents = os.listdir(self.path)
-            except OSError as err:
-                self.contents = err
-        else:
-            self.basetype = 1
-            self.contents = []
+    @contents.setter
+    def contents(self, value):
+        self._contents = value
 
     def __del__(self):
         del self.path
@@ -326,7 +1267,7 @@ class FileItem(object):
         del self.location
         del self.name
         del self.stat
-        del self.contents
+        del self._contents
 
     def __repr__(self):
         # repr(self) and str(self)
@@ -403,12 +1344,16 @@ class FileItem(object):
         # Create a ui.TableViewCell for use with FileDataSource
         cell = ui.TableViewCell("subtitle")
         cell.text_label.text = self.name
-        if not self.icon_cached and self.fileinfo.filetype == 'image':
-            thumb = get_thumbnail(self.path)
-            if thumb:  # just-in-time creation of thumbnails
-                self.icon = thumb
-                self.icon_cached = True
         cell.image_view.image = self.icon
+        if (not self.icon_cached and self.fileinfo.filetype == 'image'
+                and not isinstance(self.stat, OSError)):
+            # show the type icon for now and the thumbnail once it is ready
+            def _set_thumbnail(thumb):
+                self.icon_cached = True
+                if thumb:
+                    self.icon = thumb
+                    on_main_thread(setattr, cell.image_view, "image", thumb)
+            THUMBNAIL_LOADER.request(self.path, self.stat, _set_thumbnail)
         cell.detail_text_label.text = FILE_EXTS.get(self.fileinfo.file_ext,
                                                     self.fileinfo.filedesc)
         if not isinstance(self.stat, OSError):  # if available, add size to subtitle
@@ -418,27 +1363,226 @@ class FileItem(object):
 
 CWD_FILE_ITEM = FileItem(os.getcwd())
 
+class Inotify(object):
+    # minimal ctypes wrapper around the Linux inotify API, so that
+    # FolderWatcher wakes up as soon as a watched folder changes
+    # IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE
+    MASK = 0x002 | 0x004 | 0x008 | 0x040 | 0x080 | 0x100 | 0x200
+
+    def __init__(self):
+        # init, raises OSError or AttributeError if inotify is not available
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.watches = {}  # path -> watch descriptor
+
+    def watch(self, paths):
+        # Watch exactly the folders in the set paths
+        for path in set(self.watches) - paths:
+            self.libc.inotify_rm_watch(self.fd, self.watches.pop(path))
+        for path in paths - set(self.watches):
+            # ctypes would pass a unicode path as wchar_t*
+            encoded = path.encode(sys.getfilesystemencoding() or "utf-8") if isinstance(path, unicode) else path
+            wd = self.libc.inotify_add_watch(self.fd, encoded, self.MASK)
+            if wd >= 0:
+                self.watches[path] = wd
+
+    def wait(self, timeout):
+        # Wait until a watched folder changes or timeout seconds have passed
+        if select.select([self.fd], [], [], timeout)[0]:
+            # the events themselves are not needed, the folders are compared anyway
+            os.read(self.fd, 64 * 1024)
+
+    def close(self):
+        # Close the inotify file descriptor, which removes all watches
+        os.close(self.fd)
+        self.watches.clear()
+
+class FolderWatcher(object):
+    # checks the folders of open file lists for changes on a background thread
+    # and updates the lists. The folders are checked every interval seconds,
+    # and on Linux also as soon as inotify reports a change.
+    def __init__(self, interval):
+        # init
+        self.interval = interval
+        self.sources = weakref.WeakSet()  # FileDataSources to keep up to date
+        self.lock = threading.Lock()
+        self.thread = None
+        self.inotify = None
+
+    def watch(self, ds):
+        # Keep the FileDataSource ds up to date while it exists
+        with self.lock:
+            self.sources.add(ds)
+            if self.thread is None:
+                if sys.platform.startswith("linux"):
+                    try:
+                        self.inotify = Inotify()
+                    except (OSError, AttributeError):
+                        self.inotify = None
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+
+    def run(self):
+        # watcher thread loop, ends when no file lists are left to watch
+        while True:
+            with self.lock:
+                if not self.sources:
+                    # the next call of watch starts a new thread
+                    self.thread = None
+                    if self.inotify:
+                        self.inotify.close()
+                        self.inotify = None
+                    return
+                paths = set(ds.fi.path for ds in self.sources)
+            if self.inotify:
+                self.inotify.watch(paths)
+                self.inotify.wait(self.interval)
+            else:
+                time.sleep(self.interval)
+            with self.lock:
+                sources = list(self.sources)
+            for ds in sources:
+                changes = ds.find_changes()
+                if changes:
+                    # table views are changed on the main thread only
+                    on_main_thread(ds.apply_changes, *changes)
+            sources = ds = None  # don't keep the data sources alive while waiting
+
+FOLDER_WATCHER = FolderWatcher(WATCH_INTERVAL)
+
+_sort_modes = {}  # real path -> sort mode chosen for that folder
+
 class FileDataSource(object):
     # ui.TableView data source that generates a directory listing
     def __init__(self, fi=CWD_FILE_ITEM):
         # init
         self.fi = fi
+        self.sort_mode = _sort_modes.get(os.path.realpath(fi.path), SORT_MODES[0])
+        # FileItems of recently shown rows by section and name, oldest first
+        self.items = collections.OrderedDict()
+        # weak reference to the tableview updated by apply_changes, if set,
+        # so that the tableview and its data source don't keep each other alive
+        self.tableview_ref = None
         self.refresh()
-        self.lists = [self.folders, self.files]
 
     def refresh(self):
-        # Refresh the list of files and folders
-        self.folders = []
-        self.files = []
-        for i in range(len(self.fi.contents)):
-            if not isinstance(self.fi.contents[i], FileItem):
-                # if it isn't already, make entries FileItems rather than strings
-                self.fi.contents[i] = FileItem(self.fi.join(self.fi.contents[i]))
-
-            if self.fi.contents[i].isdir():
-                self.folders.append(self.fi.contents[i])
-            else:
-                self.files.append(self.fi.contents[i])
+        # Refresh the list of files and folders. Only names are listed here,
+        # FileItems are created when their row is first shown (see item).
+        try:
+            self.folders, self.files = list_names(self.fi.path)
+        except OSError:
+            self.folders, self.files = [], []
+        self.lists = [self.folders, self.files]
+        # (size, mtime) of all entries, from a single stat pass when first needed
+        self.sort_stats = None
+        for fi in self.items.itervalues():
+            THUMBNAIL_LOADER.cancel(fi.path)
+        self.items.clear()
+        self.sort()
+
+    def sort_key(self, isdir, name):
+        # Return the key by which the entry name is sorted in the current mode
+        if self.sort_mode == "type":
+            info = get_file_info(name, isdir)
+            return (info.filetype, info.file_ext, name.lower())
+        elif self.sort_mode == "size":  # largest first
+            return (-self.sort_stats[name][0], name.lower())
+        elif self.sort_mode == "mtime":  # newest first
+            return (-self.sort_stats[name][1], name.lower())
+        else:
+            return name.lower()
+
+    def sort(self):
+        # Sort the folders and files by the current sort mode, stat'ing
+        # the entries only if the mode needs it and they haven't been yet
+        if self.sort_mode in ("size", "mtime") and self.sort_stats is None:
+            self.sort_stats = stat_names(self.fi.path, self.folders + self.files)
+        self.folders.sort(key=lambda name: self.sort_key(True, name))
+        self.files.sort(key=lambda name: self.sort_key(False, name))
+
+    def set_sort_mode(self, mode):
+        # Change the sort mode and remember it for this folder
+        self.sort_mode = mode
+        _sort_modes[os.path.realpath(self.fi.path)] = mode
+        self.sort()
+
+    def find_changes(self):
+        # Compare the listing and the shown rows with the file system. Returns
+        # the current folder and file names and a set of names of shown
+        # entries that changed, or None if nothing changed.
+        try:
+            folders, files = list_names(self.fi.path)
+            shown = self.items.items()
+        except (OSError, KeyError, RuntimeError):
+            # KeyError and RuntimeError if items is changed at the same time
+            return None
+        changed = set()
+        for (section, name), fi in shown:
+            try:
+                st = os.stat(fi.path)
+            except OSError:  # removed, handled by the listing
+                continue
+            if isinstance(fi.stat, OSError) or (st.st_size, st.st_mtime) != (fi.stat.st_size, fi.stat.st_mtime):
+                changed.add(name)
+        if not changed and set(folders) == set(self.folders) and set(files) == set(self.files):
+            return None
+        return folders, files, changed
+
+    def apply_changes(self, folders, files, changed):
+        # Change the listing to the given folder and file names, only deleting
+        # and inserting the affected rows. Entries in changed are replaced.
+        old_names = set(self.folders + self.files)
+        new_lists = [folders, files]
+        removed_rows = []
+        for section, (old, new) in enumerate(zip(self.lists, new_lists)):
+            new = set(new)
+            for row, name in enumerate(old):
+                if name not in new or name in changed:
+                    removed_rows.append((section, row))
+                    fi = self.items.pop((section, name), None)
+                    if fi is not None:
+                        THUMBNAIL_LOADER.cancel(fi.path)
+        if self.sort_stats is not None:
+            self.sort_stats.update(stat_names(self.fi.path,
+                [name for name in folders + files if name not in old_names or name in changed]))
+
+        # first delete rows, then insert rows at their positions in the new sorted lists
+        tableview = self.tableview_ref() if self.tableview_ref else None
+        removed = set(removed_rows)
+        kept = set()
+        for section, lst in enumerate(self.lists):
+            lst[:] = [name for row, name in enumerate(lst) if (section, row) not in removed]
+            kept.update((section, name) for name in lst)
+        if removed_rows and tableview:
+            tableview.delete_rows(removed_rows)
+        for lst, new in zip(self.lists, new_lists):
+            lst[:] = new
+        self.sort()
+        inserted_rows = [(section, row) for section, lst in enumerate(self.lists)
+                         for row, name in enumerate(lst) if (section, name) not in kept]
+        if inserted_rows and tableview:
+            tableview.insert_rows(inserted_rows)
+
+    def item(self, section, row):
+        # Return the FileItem for the given section/row, creating it if necessary
+        name = self.lists[section][row]
+        key = (section, name)
+        try:
+            fi = self.items.pop(key)
+        except KeyError:
+            # no DirEntry to reuse here, the cached name lists may be older
+            # than the file's current stat data
+            fi = FileItem(self.fi.join(name))
+            if len(self.items) >= ROW_CACHE_SIZE:
+                # the oldest row is long scrolled off-screen
+                old_key, old_fi = self.items.popitem(last=False)
+                THUMBNAIL_LOADER.cancel(old_fi.path)
+        self.items[key] = fi
+        return fi
 
     def tableview_number_of_sections(self, tableview):
         # Return the number of sections
@@ -450,7 +1594,7 @@ class FileDataSource(object):
 
     def tableview_cell_for_row(self, tableview, section, row):
         # Create and return a cell for the given section/row
-        return self.lists[section][row].as_cell()
+        return self.item(section, row).as_cell()
 
     def tableview_title_for_header(self, tableview, section):
         # Return a title for the given section.
@@ -463,25 +1607,49 @@ class FileDataSource(object):
 
     def tableview_can_delete(self, tableview, section, row):
         # Return True if the user should be able to delete the given row.
-        return False
+        return True
 
     def tableview_can_move(self, tableview, section, row):
         # Return True if a reordering control should be shown for the given row (in editing mode).
         return False
 
+    @ui.in_background
     def tableview_delete(self, tableview, section, row):
-        # Called when the user confirms deletion of the given row.
-        pass
+        # Called when the user confirms deletion of the given row. Folders are
+        # deleted with all their contents, so ask again like the bulk delete.
+        name = self.lists[section][row]
+        try:
+            console.alert("Delete", "Delete \"{}\"? This can't be undone.".format(name), "Delete")
+        except KeyboardInterrupt:  # alert cancelled
+            return
+        # delete in a separate thread, large folders can take a while
+        thread = threading.Thread(target=self.delete_item, args=(name,))
+        thread.daemon = True
+        thread.start()
+
+    def delete_item(self, name):
+        # Delete the entry name and update the listing
+        op = BulkOperation("delete", [self.fi.join(name)])
+        op.run()
+        if op.errors:
+            console.hud_alert("Failed to delete: " + op.errors[0][1], "error")
+        changes = self.find_changes()
+        if changes:
+            on_main_thread(self.apply_changes, *changes)
 
     def tableview_move_row(self, tableview, from_section, from_row, to_section, to_row):
         # Called when the user moves a row with the reordering control (in editing mode).
         pass
 
+    def selected_paths(self, tableview):
+        # Return the paths of the rows selected in tableview
+        return [self.fi.join(self.lists[section][row]) for section, row in tableview.selected_rows]
+
     @ui.in_background
     def tableview_did_select(self, tableview, section, row):
         # Called when the user selects a row
         if not tableview.editing:
-            fi = self.lists[section][row]
+            fi = self.item(section, row)
             if section == 0:
                 console.show_activity()
                 nav.push_view(make_file_list(fi))
@@ -506,7 +1674,7 @@ class FileDataSource(object):
 
     def tableview_accessory_button_tapped(self, tableview, section, row):
         # Called when the user taps a row's accessory (i) button
-        nav.push_view(make_stat_view(self.lists[section][row]))
+        nav.push_view(make_stat_view(self.item(section, row)))
 
 class StatDataSource(object):
     # ui.TableView data source that shows os.stat() data on a file
@@ -515,6 +1683,10 @@ class StatDataSource(object):
         self.fi = fi
         self.refresh()
         self.lists = [("Actions", self.actions), ("Stats", self.stats), ("Flags", self.flags)]
+        self.size_thread = None
+        self.copy_thread = None
+        self.copy_cancelled = False
+        self.hash_thread = None
 
     def refresh(self):
         # Refresh stat data
@@ -557,6 +1729,9 @@ class StatDataSource(object):
             # actions for folders
             self.actions += [
                 ("shellista-cd", "Go here", "Shellista", "ionicons-ios7-arrow-forward-32"),
+                ("filenav-size", "Calculate Size", "filenav", "ionicons-pie-graph-32"),
+                ("filenav-grep", "Search Contents", "filenav", "ionicons-search-32"),
+                ("filenav-dupes", "Find Duplicates", "filenav", "ionicons-ios7-copy-outline-32"),
                             ]
         elif self.fi.isfile():
             # actions for files
@@ -565,8 +1740,8 @@ class StatDataSource(object):
                 ("pysta-edit", "Open in Editor", "Pythonista", "ionicons-ios7-compose-32"),
                 ("pysta-cpedit", "Copy & Open", "Pythonista", "ionicons-ios7-copy-32"),
                 ("pysta-cptxt", "Copy & Open as Text", "Pythonista", "ionicons-document-text-32"),
-                # haven't yet been able to integrate hexviewer
-                #("hexviewer-open", "Open in Hex Viewer", "hexviewer", "ionicons-pound-32"),
+                ("filenav-checksums", "Checksums", "MD5, SHA-1, SHA-256", "ionicons-pound-32"),
+                ("hexviewer-open", "Open in Hex Viewer", "filenav", "ionicons-pound-32"),
                 ("ios-openin", "Open In and Share", "External Apps", "ionicons-ios7-paperplane-32"),
                             ]
             if self.fi.fileinfo.file_ext in ("htm", "html"):
@@ -579,6 +1754,96 @@ class StatDataSource(object):
                 self.actions[-1:-1] = [
                     ("sound-playsound", "Play Sound", "sound", "ionicons-ios7-play-32")]
 
+    def copy_and_open(self, tableview, key, destfile, subtitle):
+        # Copy the file to destfile, showing progress in the subtitle of the
+        # action with the given key, and open the copy in the editor.
+        # subtitle is shown again when done.
+        @throttled
+        def _show_progress(done, total, step):
+            set_subtitle(self.actions, key, "{} {}% - tap to cancel".format(step, done * 100 // max(total, 1)))
+            on_main_thread(tableview.reload_data)
+
+        def _progress(done, total, step):
+            _show_progress(done, total, step)
+            return self.copy_cancelled
+
+        try:
+            copied = copy_file(self.fi.path, destfile, _progress)
+        except EnvironmentError as err:
+            set_subtitle(self.actions, key, err.strerror)
+            on_main_thread(tableview.reload_data)
+            return
+        set_subtitle(self.actions, key, subtitle)
+        on_main_thread(tableview.reload_data)
+        if copied:
+            editor.reload_files()
+            open_path(destfile)
+            nav.close()
+
+    def calculate_size(self, tableview):
+        # Calculate the size of the folder, showing progress in the action's
+        # subtitle, and add a section with the results
+        @throttled
+        def _progress(total, files):
+            set_subtitle(self.actions, "filenav-size", "{} in {} files...".format(format_size(total, False), files))
+            on_main_thread(tableview.reload_data)
+
+        try:
+            total, files, entries = dir_usage(self.fi.path, _progress)
+        except OSError as err:
+            set_subtitle(self.actions, "filenav-size", err.strerror)
+            on_main_thread(tableview.reload_data)
+            return
+        set_subtitle(self.actions, "filenav-size", "{} in {} files".format(format_size(total, False), files))
+        sizes = [
+            ("size-total", "Total Size", format_size(total), "ionicons-pie-graph-32"),
+            ("size-files", "Files", str(files), "ionicons-document-32"),
+                ]
+        sizes += [("size-entry", name, format_size(size, False), "ionicons-document-32")
+                  for size, name in entries[:LARGEST_ENTRIES]]
+        self.set_section("Size", sizes)
+        on_main_thread(tableview.reload_data)
+
+    def set_section(self, title, rows):
+        # Show rows in a section with the given title below the actions,
+        # replacing an earlier section with the same title
+        for i, (section_title, section_rows) in enumerate(self.lists):
+            if section_title == title:
+                self.lists[i] = (title, rows)
+                return
+        self.lists.insert(1, (title, rows))
+
+    def calculate_checksums(self, tableview):
+        # Calculate the checksums of the file and add a section with them
+        try:
+            sums = file_checksums(self.fi.path)
+        except EnvironmentError as err:
+            set_subtitle(self.actions, "filenav-checksums", err.strerror)
+            on_main_thread(tableview.reload_data)
+            return
+        set_subtitle(self.actions, "filenav-checksums", "Tap a checksum to copy it")
+        self.set_section("Checksums", [
+            ("checksum-md5", "MD5", sums.md5, "ionicons-pound-32"),
+            ("checksum-sha1", "SHA-1", sums.sha1, "ionicons-pound-32"),
+            ("checksum-sha256", "SHA-256", sums.sha256, "ionicons-pound-32"),
+                                      ])
+        on_main_thread(tableview.reload_data)
+
+    def search_duplicates(self, tableview):
+        # Find duplicate files in the folder, showing progress in the action's
+        # subtitle, and show them in a new view
+        @throttled
+        def _progress(step):
+            set_subtitle(self.actions, "filenav-dupes", step + "...")
+            on_main_thread(tableview.reload_data)
+
+        duplicates = find_duplicates(self.fi.path, _progress)
+        wasted = sum(size * (len(paths) - 1) for size, paths in duplicates)
+        set_subtitle(self.actions, "filenav-dupes", "{} groups, {} wasted".format(len(duplicates), format_size(wasted, False)))
+        on_main_thread(tableview.reload_data)
+        if duplicates:
+            nav.push_view(make_duplicates_view(self.fi, duplicates))
+
 
     def tableview_number_of_sections(self, tableview):
         # Return the number of sections
@@ -639,6 +1904,36 @@ class StatDataSource(object):
             shell.onecmd("cd " + self.fi.path)
             print("> cd " + self.fi.path)
             shell.cmdloop()
+        elif key == "filenav-size":
+            # Calculate Size - filenav
+            if self.size_thread is None or not self.size_thread.is_alive():
+                set_subtitle(self.actions, key, "Calculating...")
+                on_main_thread(tableview.reload_data)
+                # walk in a separate thread so other actions don't have to wait
+                self.size_thread = threading.Thread(target=self.calculate_size, args=(tableview,))
+                self.size_thread.daemon = True
+                self.size_thread.start()
+        elif key in ("filenav-checksums", "filenav-dupes"):
+            # Checksums/Find Duplicates - filenav
+            if self.hash_thread is None or not self.hash_thread.is_alive():
+                set_subtitle(self.actions, key, "Calculating...")
+                on_main_thread(tableview.reload_data)
+                target = self.calculate_checksums if key == "filenav-checksums" else self.search_duplicates
+                self.hash_thread = threading.Thread(target=target, args=(tableview,))
+                self.hash_thread.daemon = True
+                self.hash_thread.start()
+        elif key.startswith("checksum-"):
+            # copy a checksum
+            clipboard.set(self.lists[section][1][row][2])
+            console.hud_alert("Copied " + self.lists[section][1][row][1])
+        elif key == "filenav-grep":
+            # Search Contents - filenav
+            try:
+                query = console.input_alert("Search Contents", "Text to search for in " + self.fi.basename())
+            except KeyboardInterrupt:
+                return
+            if query:
+                nav.push_view(make_grep_view(self.fi, query))
         elif key == "ios-qlook":
             # Preview - Quick Look
             nav.close()
@@ -648,26 +1943,32 @@ class StatDataSource(object):
             # Open in Editor - Pythonista
             open_path(self.fi.path)
             nav.close()
-        elif key == "pysta-cpedit":
-            # Copy & Open - Pythonista
+        elif key in ("pysta-cpedit", "pysta-cptxt"):
+            # Copy & Open (as Text) - Pythonista
+            if self.copy_thread is not None and self.copy_thread.is_alive():
+                # tapping again while copying cancels
+                self.copy_cancelled = True
+                return
             destdir = full_path(os.path.join(SCRIPT_ROOT, "temp"))
             if not os.path.exists(destdir):
                 os.mkdir(destdir)
             destfile = full_path(os.path.join(destdir, self.fi.basename().lstrip(".")))
-            shutil.copy(self.fi.path, destfile)
-            editor.reload_files()
-            open_path(destfile)
-            nav.close()
-        elif key == "pysta-cptxt":
-            # Copy & Open as Text - Pythonista
-            destdir = full_path(os.path.join(SCRIPT_ROOT, "temp"))
-            if not os.path.exists(destdir):
-                os.mkdir(destdir)
-            destfile = full_path(os.path.join(destdir, self.fi.basename().lstrip(".") + ".txt"))
-            shutil.copy(self.fi.path, destfile)
-            editor.reload_files()
-            open_path(destfile)
-            nav.close()
+            if key == "pysta-cptxt":
+                destfile += ".txt"
+            self.copy_cancelled = False
+            subtitle = self.lists[section][1][row][2]
+            set_subtitle(self.actions, key, "Starting...")
+            on_main_thread(tableview.reload_data)
+            # copy in a separate thread so the copy can be cancelled
+            self.copy_thread = threading.Thread(target=self.copy_and_open, args=(tableview, key, destfile, subtitle))
+            self.copy_thread.daemon = True
+            self.copy_thread.start()
+        elif key == "hexviewer-open":
+            # Open in Hex Viewer - filenav
+            try:
+                nav.push_view(make_hex_view(self.fi))
+            except EnvironmentError as err:
+                console.hud_alert("Failed to open: " + err.strerror, "error")
         elif key == "console-printimg":
             # Show in Console - console
             console.show_image(self.fi.path)
@@ -691,6 +1992,344 @@ class StatDataSource(object):
         # Called when the user taps a row's accessory (i) button
         pass
 
+class SearchDataSource(object):
+    # ui.TableView data source and ui.TextField delegate that shows the results
+    # of a filename search
+    def __init__(self, index):
+        # init
+        self.index = index
+        self.query = ""
+        self.results = []
+        self.tableview = None
+
+    def search(self, query):
+        # Search for query and show the results
+        self.query = query
+        self.results = self.index.search(query, SEARCH_LIMIT)
+        if self.tableview:
+            on_main_thread(self.tableview.reload_data)
+
+    def update_index(self):
+        # Update the index and search again with the new data
+        self.index.update()
+        self.search(self.query)
+
+    def textfield_did_change(self, textfield):
+        # Called when the search text changes
+        self.search(textfield.text)
+
+    def tableview_number_of_sections(self, tableview):
+        # Return the number of sections
+        return 1
+
+    def tableview_number_of_rows(self, tableview, section):
+        # Return the number of rows in the section
+        return len(self.results)
+
+    def tableview_cell_for_row(self, tableview, section, row):
+        # Create and return a cell for the given section/row
+        result = self.results[row]
+        cell = ui.TableViewCell("subtitle")
+        cell.text_label.text = result.name
+        cell.image_view.image = get_file_info(result.name, result.isdir).icon
+        cell.detail_text_label.text = os.path.relpath(os.path.dirname(result.path), self.index.root)
+        if not result.isdir:
+            cell.detail_text_label.text += " (" + format_size(result.size, False) + ")"
+        return cell
+
+    def tableview_title_for_header(self, tableview, section):
+        # Return a title for the given section.
+        return "Results"
+
+    @ui.in_background
+    def tableview_did_select(self, tableview, section, row):
+        # Called when the user selects a row
+        result = self.results[row]
+        if result.isdir:
+            nav.push_view(make_file_list(FileItem(result.path)))
+        else:
+            nav.push_view(make_stat_view(FileItem(result.path)))
+
+class GrepDataSource(object):
+    # ui.TableView data source that shows the results of a content search,
+    # which are added while the search is running
+    def __init__(self, fi, query):
+        # init
+        self.fi = fi
+        # kept as unicode for the header, grep_tree encodes it again
+        self.query = query.decode("utf-8") if isinstance(query, str) else query
+        self.results = []
+        self.done = False
+        self.cancelled = False
+
+    def run(self, tableview_ref):
+        # Search and add results to the tableview as they are found.
+        # tableview_ref is a weak reference, so that the search stops once
+        # the view is gone or self.cancelled is set.
+        def _cancelled():
+            if tableview_ref() is None:
+                self.cancelled = True
+            return self.cancelled
+
+        def _reload():
+            tableview = tableview_ref()
+            if tableview is not None:
+                on_main_thread(tableview.reload_data)
+
+        _show_progress = throttled(_reload)
+        for result in grep_tree(self.fi.path, self.query, _cancelled):
+            self.results.append(result)
+            if len(self.results) >= GREP_LIMIT:
+                break
+            _show_progress()
+        self.done = True
+        _reload()
+
+    def tableview_number_of_sections(self, tableview):
+        # Return the number of sections
+        return 1
+
+    def tableview_number_of_rows(self, tableview, section):
+        # Return the number of rows in the section
+        return len(self.results)
+
+    def tableview_cell_for_row(self, tableview, section, row):
+        # Create and return a cell for the given section/row
+        result = self.results[row]
+        cell = ui.TableViewCell("subtitle")
+        cell.text_label.text = result.line
+        cell.detail_text_label.text = "{}:{}".format(os.path.relpath(result.path, self.fi.path), result.lineno)
+        cell.image_view.image = get_file_info(result.path, False).icon
+        return cell
+
+    def tableview_title_for_header(self, tableview, section):
+        # Return a title for the given section.
+        return u"{} {} for \"{}\"{}".format(len(self.results),
+                                          "match" if len(self.results) == 1 else "matches",
+                                          self.query, "" if self.done else "...")
+
+    @ui.in_background
+    def tableview_did_select(self, tableview, section, row):
+        # Called when the user selects a row
+        self.cancelled = True
+        open_path(self.results[row].path)
+        nav.close()
+
+class BulkDataSource(object):
+    # ui.TableView data source that offers operations on several selected
+    # files and folders and shows their progress
+    def __init__(self, fi, paths):
+        # init, fi is the folder containing the items at paths
+        self.fi = fi
+        self.paths = paths
+        self.op = None
+        self.thread = None
+        self.actions = [
+            ("bulk-copy", "Copy", "Copy to another folder", "ionicons-ios7-copy-32"),
+            ("bulk-move", "Move", "Move to another folder", "ionicons-ios7-redo-32"),
+            ("bulk-zip", "Zip", "Create a zip archive", "ionicons-filing-32"),
+            ("bulk-delete", "Delete", "Delete permanently", "ionicons-ios7-trash-32"),
+                       ]
+        self.lists = [("Actions", self.actions), ("Selected", self.paths)]
+
+    def run_operation(self, tableview, key):
+        # Run self.op, showing progress in the subtitle of the action with the given key
+        @throttled
+        def _progress(op):
+            text = "{}/{} items".format(op.items_done, len(op.paths))
+            if op.files_done:
+                text += ", {} files, {}".format(op.files_done, format_size(op.bytes_done, False))
+            set_subtitle(self.actions, key, text + " - tap to cancel")
+            on_main_thread(tableview.reload_data)
+
+        self.op.progress = _progress
+        try:
+            self.op.run()
+        except EnvironmentError as err:  # failed to create the archive
+            self.op.errors.append((self.op.dest, err.strerror))
+        done = "Cancelled" if self.op.cancelled else "Done"
+        set_subtitle(self.actions, key, "{}, {} of {} items failed".format(done, len(self.op.errors), len(self.paths)))
+        errors = [("{}: {}".format(os.path.basename(path), message)) for path, message in self.op.errors]
+        if errors:
+            self.lists[2:] = [("Errors", errors)]
+        on_main_thread(tableview.reload_data)
+
+    def tableview_number_of_sections(self, tableview):
+        # Return the number of sections
+        return len(self.lists)
+
+    def tableview_number_of_rows(self, tableview, section):
+        # Return the number of rows in the section
+        return len(self.lists[section][1])
+
+    def tableview_cell_for_row(self, tableview, section, row):
+        # Create and return a cell for the given section/row
+        if section == 0:
+            key, title, subtitle, icon = self.actions[row]
+            cell = ui.TableViewCell("subtitle")
+            cell.text_label.text = title
+            cell.detail_text_label.text = subtitle
+            cell.image_view.image = ui.Image.named(icon)
+        elif section == 1:
+            path = self.paths[row]
+            cell = ui.TableViewCell()
+            cell.text_label.text = os.path.basename(path)
+            cell.image_view.image = get_file_info(path).icon
+        else:
+            cell = ui.TableViewCell()
+            cell.text_label.text = self.lists[section][1][row]
+        return cell
+
+    def tableview_title_for_header(self, tableview, section):
+        # Return a title for the given section.
+        return self.lists[section][0]
+
+    @ui.in_background
+    def tableview_did_select(self, tableview, section, row):
+        # Called when the user selects a row
+        if section != 0:
+            return
+        key = self.actions[row][0]
+        if self.thread is not None and self.thread.is_alive():
+            # tapping again while running cancels
+            self.op.cancelled = True
+            return
+        try:
+            if key in ("bulk-copy", "bulk-move"):
+                # Copy/Move - ask for the destination folder
+                dest = full_path(console.input_alert(self.actions[row][1] + " to", "Destination folder", self.fi.path))
+                if not os.path.isdir(dest):
+                    console.hud_alert("Not a folder", "error")
+                    return
+                self.op = BulkOperation(key[len("bulk-"):], self.paths, dest)
+            elif key == "bulk-zip":
+                # Zip - ask for the archive name
+                name = console.input_alert("Zip", "Archive name", "Archive.zip").strip()
+                if not name or "/" in name or os.sep in name:
+                    console.hud_alert("Invalid name", "error")
+                    return
+                if not name.lower().endswith(".zip"):
+                    name += ".zip"
+                self.op = BulkOperation("zip", self.paths, unique_path(self.fi.join(name)))
+            elif key == "bulk-delete":
+                # Delete - ask for confirmation
+                console.alert("Delete", "Delete {} items? This can't be undone.".format(len(self.paths)), "Delete")
+                self.op = BulkOperation("delete", self.paths)
+        except KeyboardInterrupt:  # alert cancelled
+            return
+        set_subtitle(self.actions, key, "Starting...")
+        on_main_thread(tableview.reload_data)
+        self.thread = threading.Thread(target=self.run_operation, args=(tableview, key))
+        self.thread.daemon = True
+        self.thread.start()
+
+class DuplicatesDataSource(object):
+    # ui.TableView data source that shows groups of duplicate files
+    def __init__(self, fi, duplicates):
+        # init, duplicates is a list of (size, paths) as from find_duplicates
+        self.fi = fi
+        self.duplicates = duplicates
+
+    def tableview_number_of_sections(self, tableview):
+        # Return the number of sections
+        return len(self.duplicates)
+
+    def tableview_number_of_rows(self, tableview, section):
+        # Return the number of rows in the section
+        return len(self.duplicates[section][1])
+
+    def tableview_cell_for_row(self, tableview, section, row):
+        # Create and return a cell for the given section/row
+        path = self.duplicates[section][1][row]
+        cell = ui.TableViewCell("subtitle")
+        cell.text_label.text = os.path.basename(path)
+        cell.detail_text_label.text = os.path.relpath(os.path.dirname(path), self.fi.path)
+        cell.image_view.image = get_file_info(path, False).icon
+        cell.accessory_type = "disclosure_indicator"
+        return cell
+
+    def tableview_title_for_header(self, tableview, section):
+        # Return a title for the given section.
+        size, paths = self.duplicates[section]
+        return "{} copies of {}".format(len(paths), format_size(size, False))
+
+    @ui.in_background
+    def tableview_did_select(self, tableview, section, row):
+        # Called when the user selects a row
+        nav.push_view(make_stat_view(FileItem(self.duplicates[section][1][row])))
+
+class HexDataSource(object):
+    # ui.TableView data source that shows a hex dump of a file. The file is
+    # memory-mapped and only the rows that are shown are read and formatted,
+    # so large files open instantly and use little memory. The file itself is
+    # closed right away, the mapping is freed with the data source.
+    def __init__(self, fi):
+        # init
+        self.fi = fi
+        with open(fi.path, "rb") as f:
+            self.size = os.fstat(f.fileno()).st_size
+            # empty files can't be mapped
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else ""
+        self.pattern = None
+        self.search_pos = 0
+
+    def format_row(self, row):
+        # Return the hex dump line for the given row
+        offset = row * HEX_ROW_SIZE
+        chunk = self.data[offset:offset + HEX_ROW_SIZE]
+        hex_bytes = " ".join("{:02x}".format(ord(c)) for c in chunk)
+        text = "".join(c if 32 <= ord(c) < 127 else "." for c in chunk)
+        return "{:08x}  {:<{width}}  {}".format(offset, hex_bytes, text, width=HEX_ROW_SIZE * 3 - 1)
+
+    def find(self, pattern):
+        # Return the offset of the next occurrence of pattern after the last
+        # one found, continuing at the start of the file, or -1 if not found
+        if pattern != self.pattern:
+            self.pattern = pattern
+            self.search_pos = 0
+        pos = self.data.find(pattern, self.search_pos)
+        if pos == -1 and self.search_pos > 0:
+            pos = self.data.find(pattern, 0)
+        if pos != -1:
+            self.search_pos = pos + 1
+        return pos
+
+    def go_to(self, tableview, offset):
+        # Scroll tableview to the row containing offset and select it
+        row = max(0, min(offset, self.size - 1)) // HEX_ROW_SIZE
+        on_main_thread(setattr, tableview, "content_offset", (0, row * tableview.row_height))
+        on_main_thread(setattr, tableview, "selected_row", (0, row))
+
+    def tableview_number_of_sections(self, tableview):
+        # Return the number of sections
+        return 1
+
+    def tableview_number_of_rows(self, tableview, section):
+        # Return the number of rows in the section
+        return (self.size + HEX_ROW_SIZE - 1) // HEX_ROW_SIZE
+
+    def tableview_cell_for_row(self, tableview, section, row):
+        # Create and return a cell for the given section/row
+        cell = ui.TableViewCell()
+        cell.text_label.font = ("Menlo", 12)
+        cell.text_label.text = self.format_row(row)
+        return cell
+
+    def tableview_title_for_header(self, tableview, section):
+        # Return a title for the given section.
+        return format_size(self.size)
+
+def parse_pattern(text):
+    # Return the bytes described by text. Text in quotes is searched for
+    # literally as UTF-8, anything else is read as hex digits. Raises
+    # TypeError for invalid hex digits.
+    if isinstance(text, unicode):
+        text = text.encode("utf-8")
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in "\"'":
+        return text[1:-1]
+    return binascii.unhexlify("".join(text.split()))
+
 def check_bit(num, bit):
     # Check if bit is set in num
     return (num ^ bit) < num
@@ -723,6 +2362,70 @@ def toggle_edit_proxy(parent):
         parent.set_editing(not parent.editing)
     return _toggle_edit
 
+def search_proxy():
+    # Returns a function that opens the filename search
+    def _search(sender):
+        nav.push_view(make_search_view())
+    return _search
+
+def sort_proxy(parent):
+    # Returns a function that switches parent to the next sort mode
+    def _sort(sender):
+        ds = parent.data_source
+        ds.set_sort_mode(SORT_MODES[(SORT_MODES.index(ds.sort_mode) + 1) % len(SORT_MODES)])
+        sender.title = SORT_TITLES[ds.sort_mode]
+        parent.reload_data()
+    return _sort
+
+def bulk_proxy(parent):
+    # Returns a function that shows operations for the rows selected in parent
+    def _bulk(sender):
+        paths = parent.data_source.selected_paths(parent) if parent.editing else []
+        if not paths:
+            console.hud_alert("Tap Edit and select items first", "error")
+            return
+        nav.push_view(make_bulk_view(parent.data_source.fi, paths))
+    return _bulk
+
+def hex_goto_proxy(parent):
+    # Returns a function that asks for an offset and shows it in the hex view parent
+    @ui.in_background
+    def _goto(sender):
+        try:
+            text = console.input_alert("Go to Offset", "Decimal or hex (0x...)", "0x")
+        except KeyboardInterrupt:
+            return
+        try:
+            offset = int(text, 0)
+        except ValueError:
+            console.hud_alert("Invalid offset", "error")
+            return
+        parent.data_source.go_to(parent, offset)
+    return _goto
+
+def hex_find_proxy(parent):
+    # Returns a function that asks for a byte pattern and shows its next
+    # occurrence in the hex view parent
+    @ui.in_background
+    def _find(sender):
+        ds = parent.data_source
+        try:
+            text = console.input_alert("Find", "Hex bytes (4d 5a) or \"text\"", ds.pattern and binascii.hexlify(ds.pattern) or "")
+        except KeyboardInterrupt:
+            return
+        try:
+            pattern = parse_pattern(text)
+        except TypeError:
+            console.hud_alert("Invalid hex bytes", "error")
+            return
+        offset = ds.find(pattern) if pattern else -1
+        if offset == -1:
+            console.hud_alert("Not found", "error")
+        else:
+            ds.go_to(parent, offset)
+            console.hud_alert("Found at 0x{:x}".format(offset))
+    return _find
+
 def close_proxy():
     # Returns a function that closes the main view
     def _close(sender):
@@ -739,8 +2442,15 @@ def make_file_list(fi=CWD_FILE_ITEM):
     lst.allows_multiple_selection_during_editing = True
     lst.background_color = 1.0
     lst.data_source = lst.delegate = FileDataSource(fi)
+    lst.data_source.tableview_ref = weakref.ref(lst)
+    FOLDER_WATCHER.watch(lst.data_source)
     lst.name = "/" if fi.path == "/" else fi.basename()
-    lst.right_button_items = ui.ButtonItem(title="Edit", action=toggle_edit_proxy(lst)),
+    lst.right_button_items = (ui.ButtonItem(title="Edit", action=toggle_edit_proxy(lst)),
+                              ui.ButtonItem(title=SORT_TITLES[lst.data_source.sort_mode],
+                                            action=sort_proxy(lst)),
+                              ui.ButtonItem(image=ui.Image.named("ionicons-search-24"),
+                                            action=search_proxy()),
+                              ui.ButtonItem(title="Selected", action=bulk_proxy(lst)))
     return lst
 
 def make_stat_view(fi=CWD_FILE_ITEM):
@@ -756,6 +2466,76 @@ def make_stat_view(fi=CWD_FILE_ITEM):
     lst.name = "/" if fi.path == "/" else fi.basename()
     return lst
 
+def make_bulk_view(fi, paths):
+    # Create a ui.TableView with operations on the items at paths in fi
+    lst = ui.TableView(flex="WH")
+    lst.allows_selection = True
+    lst.allows_multiple_selection = False
+    lst.background_color = 1.0
+    lst.data_source = lst.delegate = BulkDataSource(fi, paths)
+    lst.name = "{} Items".format(len(paths))
+    return lst
+
+def make_duplicates_view(fi, duplicates):
+    # Create a ui.TableView listing groups of duplicate files in fi
+    lst = ui.TableView(flex="WH")
+    lst.allows_selection = True
+    lst.allows_multiple_selection = False
+    lst.background_color = 1.0
+    lst.data_source = lst.delegate = DuplicatesDataSource(fi, duplicates)
+    lst.name = "Duplicates in " + ("/" if fi.path == "/" else fi.basename())
+    return lst
+
+def make_hex_view(fi):
+    # Create a ui.TableView showing a hex dump of the file fi
+    lst = ui.TableView(flex="WH")
+    lst.row_height = HEX_ROW_HEIGHT
+    lst.allows_selection = True
+    lst.allows_multiple_selection = False
+    lst.background_color = 1.0
+    lst.data_source = lst.delegate = HexDataSource(fi)
+    lst.name = fi.basename()
+    lst.right_button_items = (ui.ButtonItem(title="Find", action=hex_find_proxy(lst)),
+                              ui.ButtonItem(title="Go to", action=hex_goto_proxy(lst)))
+    return lst
+
+def make_search_view():
+    # Create a ui.View with a search field and a list of matching files.
+    # The last saved index is searched right away and updated in the background.
+    ds = SearchDataSource(get_search_index())
+    view = ui.View(frame=(0, 0, 540, 600), flex="WH", name="Search")
+    view.background_color = 1.0
+    field = ui.TextField(frame=(6, 6, 528, 32), flex="W")
+    field.placeholder = "Name, *pattern* or .extension"
+    field.clear_button_mode = "while_editing"
+    field.autocapitalization_type = ui.AUTOCAPITALIZE_NONE
+    field.autocorrection_type = False
+    field.delegate = ds
+    lst = ui.TableView(frame=(0, 44, 540, 556), flex="WH")
+    lst.background_color = 1.0
+    lst.data_source = lst.delegate = ds
+    ds.tableview = lst
+    view.add_subview(field)
+    view.add_subview(lst)
+    thread = threading.Thread(target=ds.update_index)
+    thread.daemon = True
+    thread.start()
+    return view
+
+def make_grep_view(fi, query):
+    # Create a ui.TableView listing the lines containing query in the files
+    # in fi, and start the search in the background
+    lst = ui.TableView(flex="WH")
+    lst.allows_selection = True
+    lst.allows_multiple_selection = False
+    lst.background_color = 1.0
+    lst.data_source = lst.delegate = GrepDataSource(fi, query)
+    lst.name = "Search in " + ("/" if fi.path == "/" else fi.basename())
+    thread = threading.Thread(target=lst.data_source.run, args=(weakref.ref(lst),))
+    thread.daemon = True
+    thread.start()
+    return lst
+
 def run(path="~", mode="popover"):
     # Run the main UI application
     global nav